@@ -0,0 +1,84 @@
+########################################################
+# Rule-based ENO controllers as batch policies
+########################################################
+import copy
+import numpy as np
+import pandas as pd
+
+from common.vec_env_lib import VecEnoEnv
+from common.eval_fn import evaluation_traces, run_policy
+
+########################################################
+# Controllers: batch of observations (node x [time, henergy, penergy, benergy]) >> batch of actions
+########################################################
+# Each factory takes an env that has been reset (a VecEnoEnv or an eno_v0-family env) for its
+# constants, and returns a stateless policy for eval_fn.evaluate_policy() / run_policy().
+# The controllers pick a duty cycle, which is mapped to the nearest action.
+# penergy_obs is normalized by the max of the smoothed prediction, so it runs about 3x higher than
+# henergy_obs: the predicted harvest is taken as PENERGY_SCALE*penergy_obs.
+PENERGY_SCALE = 1/3
+def duty_cycle_action(env, sense_dc):
+    # inverse of sense_dc = action/NO_OF_DUTY_CYCLES + MIN_DC, clipped to the action space
+    action = np.rint((sense_dc - env.MIN_DC)*env.NO_OF_DUTY_CYCLES)
+    return np.clip(action, 0, env.NO_OF_DUTY_CYCLES-1).astype(np.int64)
+
+def threshold_policy(env, LOW_BATT=0.3, HIGH_BATT=0.7, ACTIONS=None):
+    # ACTIONS[0] below LOW_BATT, ACTIONS[1] in between, ACTIONS[2] above HIGH_BATT
+    # (default: lowest, middle and highest duty cycle)
+    if ACTIONS is None:
+        ACTIONS = (0, env.NO_OF_DUTY_CYCLES//2, env.NO_OF_DUTY_CYCLES-1)
+    ACTIONS = np.asarray(ACTIONS)
+    thresholds = np.array([LOW_BATT, HIGH_BATT])
+    def policy(obs):
+        return ACTIONS[np.searchsorted(thresholds, obs[:,3], side='right')]
+    return policy
+
+def proportional_policy(env, GAIN=1.0):
+    # duty cycle proportional to the battery: sense_dc = GAIN*benergy_obs
+    def policy(obs):
+        return duty_cycle_action(env, GAIN*obs[:,3])
+    return policy
+
+def prediction_policy(env, PENERGY_SCALE=PENERGY_SCALE):
+    # spends the predicted harvest: sense_dc*DFACTOR = PENERGY_SCALE*penergy_obs*HFACTOR
+    def policy(obs):
+        return duty_cycle_action(env, PENERGY_SCALE*obs[:,2]*env.HFACTOR/env.DFACTOR)
+    return policy
+
+def energy_neutral_policy(env, BTARGET=0.5, HORIZON=None, PENERGY_SCALE=PENERGY_SCALE):
+    # Kansal et al. (2007) style: spends the predicted harvest plus the deviation of the battery
+    # from BTARGET spread over HORIZON timeslots (default: one day)
+    #     sense_dc*DFACTOR = PENERGY_SCALE*penergy_obs*HFACTOR + (benergy_obs - BTARGET)/HORIZON
+    if HORIZON is None:
+        HORIZON = len(env.env_timeslot_values)
+    def policy(obs):
+        consumption = PENERGY_SCALE*obs[:,2]*env.HFACTOR + (obs[:,3] - BTARGET)/HORIZON
+        return duty_cycle_action(env, consumption/env.DFACTOR)
+    return policy
+
+BASELINES = {'threshold':       threshold_policy,
+             'proportional':    proportional_policy,
+             'prediction':      prediction_policy,
+             'energy_neutral':  energy_neutral_policy}
+
+########################################################
+# Baseline table over many traces
+########################################################
+def evaluate_baselines(ENV_NAME='eno_v0', traces=None, SEEDS=None, baselines=None):
+    # eval_fn.evaluate_policy() table of each controller of baselines (name >> factory, default: BASELINES)
+    # on every trace (default: all of solar_data/), with the controller name in a 'controller' column.
+    # All the controllers see the same harvester noise.
+    if traces is None:
+        traces = evaluation_traces()
+    if baselines is None:
+        baselines = BASELINES
+    fresh_env = VecEnoEnv(ENV_NAME)
+    fresh_env.reset(traces, SEEDS=SEEDS) # the harvesters are built once, each controller runs on a copy
+    tables = []
+    for name, factory in baselines.items():
+        vec_env = copy.deepcopy(fresh_env)
+        table = run_policy(vec_env, factory(vec_env))
+        table.insert(0, 'controller', name)
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+########################################################
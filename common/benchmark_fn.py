@@ -0,0 +1,99 @@
+########################################################
+# Micro-benchmarks for the environment library
+# Usage (from the repository root):
+#     python -m common.benchmark_fn <benchmark>
+########################################################
+import sys
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+
+from common import env_lib
+
+########################################################
+# CSV parsing: dedicated parser vs pandas
+########################################################
+def parse_gsr_csv_pandas(sfile):
+    # reference implementation (the original pandas path of csv2gsr)
+    import pandas as pd
+    solar_radiation = pd.read_csv(sfile, skiprows=4, encoding='shift_jisx0213', usecols=[4])
+    solar_radiation = solar_radiation.values
+    solar_radiation[np.isnan(solar_radiation)] = 0
+    solar_radiation = solar_radiation.reshape(1,-1).flatten()
+    return solar_radiation
+
+def bench_parse_gsr_csv(REPEATS=3):
+    sfiles = sorted((Path.cwd() / 'solar_data').glob('*/*.csv'))
+    import pandas as pd # keep the import itself out of the measurement
+
+    results = {}
+    for name, parser in (('pandas', parse_gsr_csv_pandas), ('parse_gsr_csv', env_lib.parse_gsr_csv)):
+        times = []
+        for _ in range(REPEATS):
+            start_time = time.perf_counter()
+            traces = [parser(sfile) for sfile in sfiles]
+            times.append(time.perf_counter() - start_time)
+        results[name] = traces
+        print("{:16s} {} files: {:.3f} s (best of {})".format(name, len(sfiles), min(times), REPEATS))
+
+    identical = all(np.array_equal(a, b) for a, b in zip(results['pandas'], results['parse_gsr_csv']))
+
+    # a CSV whose last row has no trailing newline must keep that row
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sfile = Path(tmp_dir) / sfiles[0].name
+        sfile.write_bytes(sfiles[0].read_bytes().rstrip(b'\r\n'))
+        identical &= np.array_equal(parse_gsr_csv_pandas(sfile), env_lib.parse_gsr_csv(sfile))
+    print("IDENTICAL OUTPUT:", identical)
+    return identical
+########################################################
+
+########################################################
+# eno_v0.step: default path vs FAST_STEP
+########################################################
+def run_eno_episode(ENV_NAME, FAST_STEP, LOG_DATA, SEED=0):
+    # one year of tokyo 1995 with a fixed seed and a fixed action sequence
+    np.random.seed(SEED)
+    env = getattr(env_lib, ENV_NAME)()
+    env.FAST_STEP = FAST_STEP
+    obs = env.reset('tokyo', 1995, LOG_DATA=LOG_DATA)
+    actions = np.random.RandomState(SEED).randint(env.NO_OF_DUTY_CYCLES, size=env.ENV_LIFETIME*len(env.env_timeslot_values)).tolist()
+    obs_rec, reward_rec = [obs], []
+    done = False
+    step = 0
+    start_time = time.perf_counter()
+    while not done:
+        obs, reward, done, _ = env.step(-1 if env.RECOVERY_MODE else actions[step])
+        obs_rec.append(obs)
+        reward_rec.append(reward)
+        step += 1
+    elapsed = time.perf_counter() - start_time
+    return np.array(obs_rec), np.array(reward_rec, dtype=np.float64), step, elapsed
+
+def bench_fast_step(ENV_NAME='eno_v0', REPEATS=3, LOG_DATA=False):
+    results = {}
+    for FAST_STEP in (False, True):
+        times = []
+        for _ in range(REPEATS):
+            obs_rec, reward_rec, steps, elapsed = run_eno_episode(ENV_NAME, FAST_STEP, LOG_DATA)
+            times.append(elapsed)
+        results[FAST_STEP] = (obs_rec, reward_rec)
+        print("{:16s} {} steps: {:.3f} s, {:.0f} steps/s (best of {})".format(
+              'FAST_STEP' if FAST_STEP else 'step', steps, min(times), steps/min(times), REPEATS))
+
+    identical = (np.array_equal(results[False][0], results[True][0]) and
+                 np.array_equal(results[False][1], results[True][1]))
+    print("IDENTICAL TRAJECTORY:", identical)
+    return identical
+########################################################
+
+BENCHMARKS = {
+    'csv': bench_parse_gsr_csv,
+    'step': bench_fast_step,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(BENCHMARKS)
+    for name in names:
+        print("\n" + name)
+        BENCHMARKS[name]()
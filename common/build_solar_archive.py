@@ -0,0 +1,19 @@
+########################################################
+# Pack solar_data/<location>/<year>.csv into one archive
+# Usage (from the repository root):
+#     python -m common.build_solar_archive [solar_dir]
+########################################################
+import sys
+import time
+
+from common import env_lib
+
+if __name__ == '__main__':
+    solar_dir = sys.argv[1] if len(sys.argv) > 1 else None
+    start_time = time.time()
+    index = env_lib.build_solar_archive(solar_dir)
+    data_file, index_file = env_lib.solar_archive_files(solar_dir)
+    print("TRACES:\t\t", len(index))
+    print("ARCHIVE:\t", data_file)
+    print("INDEX:\t\t", index_file)
+    print("TIME ELAPSED:\t", time.time() - start_time)
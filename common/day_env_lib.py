@@ -0,0 +1,202 @@
+########################################################
+# Day-level environments: one step = one day of timeslots
+########################################################
+import numpy as np
+import gym
+from gym import spaces
+
+from common import env_lib, reward_lib
+
+########################################################
+# day_env: an eno_v0-family env stepped one day at a time
+########################################################
+class day_env(env_lib.env_log_views, gym.Env):
+    # One step takes every timeslot of a day of the eno_v0-family env ENV_NAME, following a duty cycle schedule.
+    #     action : NO_OF_BLOCKS duty cycle actions, each held for TIMESLOTS_PER_DAY/NO_OF_BLOCKS timeslots
+    #              (NO_OF_BLOCKS = TIMESLOTS_PER_DAY gives a full schedule)
+    #     obs    : [benergy_obs, RECOVERY_MODE, mean penergy of each block of the day]
+    #     reward : sum of the rewards of the timeslots, the k-th one discounted by GAMMA**k
+    #     info   : 'duration' (timeslots advanced), 'rewards' (reward of each timeslot)
+    # The logs (env_log, action_log, eno_log, daily_log) have one entry per timeslot, as in the eno_v0 family.
+    # The day is simulated exactly as step() would, in runs of timeslots without clipping or
+    # mode changes, each computed with one np.cumsum (sequential, like step()); only the timeslots
+    # where the battery clips or the node enters recovery mode are stepped one by one. A full battery
+    # that keeps charging and a recovery period are runs as well.
+    # The first day starts at the observation returned by reset() (the second timeslot of the trace),
+    # and the last one ends at the end of the trace. Rewards are computed by reward_lib.relabel().
+    metadata = {'render.modes': ['human']}
+
+    def __init__(self, ENV_NAME='eno_v0_T24', NO_OF_BLOCKS=24):
+        super(day_env, self).__init__()
+        self.ENV_NAME = ENV_NAME
+        self.env = getattr(env_lib, ENV_NAME)() # characterizes the harvester, battery and reward
+        self.NO_OF_BLOCKS = NO_OF_BLOCKS
+        self.NO_OF_DUTY_CYCLES = self.env.NO_OF_DUTY_CYCLES
+        self.action_space = spaces.MultiDiscrete([self.NO_OF_DUTY_CYCLES]*NO_OF_BLOCKS)
+        self.observation_space = spaces.Box(low=0,
+                                            high=1,
+                                            shape=(2+NO_OF_BLOCKS,))
+        self.GAMMA = 1.0 # discount of the rewards within a day
+
+    def reset(self, location, year, LOG_DATA=True):
+        assert np.ndim(year) == 0, 'day_env runs one year per episode'
+        env = self.env
+        env.reset(location, year, LOG_DATA=False)
+        harvester = env.env_harvester
+        self.TIMESLOTS_PER_DAY = len(env.env_timeslot_values)
+        assert self.TIMESLOTS_PER_DAY % self.NO_OF_BLOCKS == 0, 'NO_OF_BLOCKS must divide the timeslots of a day'
+
+        # Harvester streams
+        self.time_stream = harvester.time_stream
+        self.henergy_stream = harvester.henergy_stream
+        self.penergy_stream = harvester.penergy_stream
+        self.day_end_stream = harvester.day_end_stream
+        self.last_time = harvester.last_time
+        self.global_time = harvester.global_time
+
+        # Battery and flags
+        self.batt = env.env_battery.batt
+        self.benergy_obs = env.benergy_obs
+        self.RECOVERY_MODE = False
+
+        self.LOG_DATA = LOG_DATA
+        self.logger = env_lib.env_logger(LOG_DATA,
+                                         len(self.henergy_stream),
+                                         env.observation_space.shape[0],
+                                         self.TIMESLOTS_PER_DAY)
+        self.logger.log_obs(env.obs, self.day_end_stream[self.global_time])
+        self.trajectory = None # timeslots of the last day, see reward_lib.Trajectory
+        return self.get_obs()
+
+    def get_obs(self):
+        T = self.TIMESLOTS_PER_DAY
+        day = self.global_time // T
+        penergy = self.penergy_stream[day*T:(day+1)*T].reshape(self.NO_OF_BLOCKS, -1).mean(axis=1)
+        return np.concatenate(([self.benergy_obs, float(self.RECOVERY_MODE)], penergy))
+
+    def step(self, action):
+        env = self.env
+        T = self.TIMESLOTS_PER_DAY
+        action = np.asarray(action)
+        assert action.shape == (self.NO_OF_BLOCKS,), "Invalid Action"
+        assert np.all((0 <= action) & (action < self.NO_OF_DUTY_CYCLES)), "Invalid Action"
+        schedule = np.repeat(action, T//self.NO_OF_BLOCKS)
+
+        # steps on the observations start..stop-1 of the current day
+        start = self.global_time
+        stop = min((start//T + 1)*T, self.last_time)
+        done = stop == self.last_time
+        sense_dc = schedule[np.arange(start, stop) % T]/self.NO_OF_DUTY_CYCLES + env.MIN_DC
+        benergy, recovery, eno = self.simulate(sense_dc, self.henergy_stream[start:stop], done)
+        self.global_time = stop
+        # the battery observation is not updated on the last timeslot of the trace
+        self.benergy_obs = benergy[-1] if done else self.batt
+
+        # Trajectory of the day and its rewards
+        next_benergy = np.append(benergy[1:], self.benergy_obs)
+        obs = np.column_stack((self.time_stream[start:stop]/env.READINGS_PER_DAY,
+                               self.henergy_stream[start:stop],
+                               self.penergy_stream[start:stop],
+                               benergy))
+        next_obs = np.column_stack((self.time_stream[start+1:stop+1]/env.READINGS_PER_DAY,
+                                    self.henergy_stream[start+1:stop+1],
+                                    self.penergy_stream[start+1:stop+1],
+                                    next_benergy))
+        updated = np.ones(len(benergy), dtype=bool)
+        updated[-1] = not done
+        next_recovery = recovery & ~(updated & (next_benergy > env.BINIT)) # snap out of recovery mode
+        action_log = np.where(recovery, -1, sense_dc)
+        trajectory = reward_lib.Trajectory(obs, action_log, recovery, next_obs, next_recovery)
+        rewards = self.relabel(trajectory)
+        self.trajectory = trajectory
+
+        self.logger.log_block(action_log, eno, next_obs, self.day_end_stream[start+1:stop+1])
+
+        reward = np.dot(self.GAMMA**np.arange(len(rewards)), rewards)
+        info = {'duration': len(rewards), 'rewards': rewards}
+        return self.get_obs(), reward, done, info
+
+    def relabel(self, trajectory):
+        # rewards of the env on the timeslots of trajectory; rewards that look back over the
+        # last day (sparse_v0_*) also see the timeslots of the previous day
+        if self.trajectory is None:
+            return reward_lib.relabel(trajectory, self.env)
+        joined = reward_lib.Trajectory(*[np.concatenate((previous, current))
+                                         for previous, current in zip(self.trajectory, trajectory)])
+        return reward_lib.relabel(joined, self.env)[-len(trajectory.obs):]
+
+    def simulate(self, sense_dc, henergy, END):
+        # Runs step() over the timeslots of henergy with the duty cycles sense_dc, from self.batt and
+        # self.RECOVERY_MODE. Returns the battery observation, the recovery flag of the reward and the eno
+        # value of each step. END: the trace ends with this block (no recovery exit on its last observation).
+        env = self.env
+        harvested_energy = henergy*env.HFACTOR
+        surplus_energy = harvested_energy - (sense_dc)*env.DFACTOR
+        charge = harvested_energy*env.BEFF # recovery_action()
+        delta = np.where(surplus_energy > 0, surplus_energy*env.BEFF, surplus_energy) # execute_action()
+        MIN_BATT, BINIT = env.MIN_BATT, env.BINIT
+
+        length = len(henergy)
+        benergy = np.zeros(length)
+        recovery = np.zeros(length, dtype=bool)
+        batt = self.batt
+        RECOVERY_MODE = self.RECOVERY_MODE
+        j = 0
+        while j < length:
+            if RECOVERY_MODE:
+                # charge until the battery exceeds BINIT; it stays below 1 until then
+                batt_run = np.cumsum(np.concatenate(([batt], charge[j:])))
+                EXIT = batt_run[1:] > BINIT
+                if END:
+                    EXIT[-1] = False
+                exits = np.flatnonzero(EXIT)
+                run = exits[0] + 1 if len(exits) else length - j
+                benergy[j:j+run] = batt_run[:run]
+                recovery[j:j+run] = True
+                batt = min(batt_run[run], 1.0)
+                RECOVERY_MODE = not len(exits)
+                j += run
+                continue
+
+            if batt == 1.0:
+                # a full battery stays full while the action leaves a surplus
+                stops = np.flatnonzero(surplus_energy[j:] <= 0)
+                run = stops[0] if len(stops) else length - j
+                benergy[j:j+run] = 1.0
+                j += run
+                if j == length:
+                    break
+
+            # valid actions without clipping
+            batt_run = np.cumsum(np.concatenate(([batt], delta[j:])))
+            EVENT = ((batt_run[:-1] < MIN_BATT) | ~((-surplus_energy[j:]) < batt_run[:-1]) |
+                     (batt_run[1:] > 1) | (batt_run[1:] < 0))
+            events = np.flatnonzero(EVENT)
+            run = events[0] if len(events) else length - j
+            benergy[j:j+run] = batt_run[:run]
+            batt = batt_run[run]
+            j += run
+            if j == length:
+                break
+
+            # one step that clips or goes into recovery mode
+            benergy[j] = batt
+            if batt < MIN_BATT: # Is battery less than a threshold?
+                RECOVERY_MODE = True
+            elif (-surplus_energy[j]) < batt: # valid action
+                batt = min(max(batt + delta[j], 0.0), 1.0)
+            else:
+                RECOVERY_MODE = True
+            if RECOVERY_MODE:
+                recovery[j] = True
+                batt = min(max(batt + charge[j], 0.0), 1.0)
+                if batt > BINIT and not (END and j == length-1):
+                    RECOVERY_MODE = False # snap out of recovery mode
+            j += 1
+
+        self.batt = batt
+        self.RECOVERY_MODE = RECOVERY_MODE
+        eno = np.where(recovery, harvested_energy, surplus_energy)
+        return benergy, recovery, eno
+# End of day_env
+########################################################
@@ -1,37 +1,254 @@
-from scipy.interpolate import interp1d
 import numpy as np
-import pandas as pd
 from pathlib import Path
+import copy
+import functools
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import gym
 from gym import spaces
 
+from common import reward_lib
+
 ########################################################
 # Read GSR values from CSV and convert to henergy
 ########################################################
-def csv2gsr(location,year,SMAX):
+def csv2gsr(location,year,SMAX,USE_CACHE=True):
     # Get data from CSV
     #####################
     # solar_data/CSV files contain the values of GSR (Global Solar Radiation in MegaJoules per meters squared per hour)
     # weather_data/CSV files contain the weather summary from 06:00 to 18:00 and 18:00 to 06:00+1
+    # The trace is returned read-only whichever path serves it (archive, cache or CSV), so that a
+    # caller cannot modify it in place on a cold load and then fail once the cache exists.
+    # Copy it (np.array(henergy)) to modify it.
 
     sfile = Path.cwd() / 'solar_data' / location / (str(year) + '.csv')
 
-    # skiprows=4 to remove unnecessary title texts
-    # usecols=4 to read only the Global Solar Radiation (GSR) values
-    solar_radiation = pd.read_csv(sfile, skiprows=4, encoding='shift_jisx0213', usecols=[4])
-
-    # convert dataframe to numpy array
-    solar_radiation = solar_radiation.values
+    if USE_CACHE:
+        # Read from the consolidated archive if it has been built and this CSV has not changed since
+        archive_slice = solar_archive_trace(sfile, location, year)
+        if archive_slice is not None:
+            henergy = archive_slice/SMAX # normalize (one copy of the memory-mapped slice)
+            henergy.setflags(write=False)
+            return henergy
 
-    # convert missing data in CSV files to zero
-    solar_radiation[np.isnan(solar_radiation)] = 0
+        # Look for an already decoded copy of this CSV
+        cfile = gsr_cache_file(sfile, location, year, SMAX)
+        if cfile.exists():
+            return np.load(cfile, mmap_mode='r') # read-only, memory-mapped
 
-    # reshape solar_radiation into no_of_daysxREADINGS_PER_DAY array
-    solar_radiation = solar_radiation.reshape(1,-1).flatten() # 1-D array
+    solar_radiation = parse_gsr_csv(sfile)
     henergy = solar_radiation/SMAX # normalize
+
+    if USE_CACHE:
+        save_gsr_cache(cfile, henergy)
+    henergy.setflags(write=False)
     return henergy
-########################################################
 
+def gsr_trace_length(location, year, SMAX, USE_CACHE=True):
+    # number of readings csv2gsr(location, year, SMAX) returns, without decoding the trace:
+    # from the archive index or the cache file header if there is one, else by counting the CSV rows
+    sfile = Path.cwd() / 'solar_data' / location / (str(year) + '.csv')
+    if USE_CACHE:
+        archive_slice = solar_archive_trace(sfile, location, year)
+        if archive_slice is not None:
+            return len(archive_slice) # memory-mapped, nothing is read
+        cfile = gsr_cache_file(sfile, location, year, SMAX)
+        if cfile.exists():
+            return np.load(cfile, mmap_mode='r').shape[0]
+    raw = sfile.read_bytes()
+    start = 0
+    for _ in range(5): # skip title texts and column headers
+        start = raw.index(b'\n', start) + 1
+    return sum(1 for row in raw[start:].split(b'\n') if b',' in row) # parse_gsr_csv skips blank rows
+
+def parse_gsr_csv(sfile):
+    # Dedicated reader for the JMA CSV layout:
+    #   5 title/header rows, then one row per hour "year,month,day,hour,GSR,quality,homogeneity[,...]"
+    # Only column 4 (GSR) is decoded, directly from the raw bytes.
+    # Missing (blank) GSR values are converted to zero.
+    raw = Path(sfile).read_bytes()
+    start = 0
+    for _ in range(5): # skip title texts and column headers
+        start = raw.index(b'\n', start) + 1
+    body = np.frombuffer(raw, dtype=np.uint8, offset=start)
+
+    # locate the GSR field of every row from the comma positions
+    commas = np.flatnonzero(body == ord(','))
+    line_ends = np.flatnonzero(body == ord('\n'))
+    if len(body) and body[-1] != ord('\n'):
+        line_ends = np.r_[line_ends, len(body)] # last row without a trailing newline
+    first_comma = np.searchsorted(commas, np.r_[0, line_ends[:-1]+1]) # first comma of each row
+    ncommas = np.diff(np.r_[first_comma, len(commas)])
+    first_comma = first_comma[ncommas > 0] # skip blank rows
+    if len(first_comma)==0 or ncommas[ncommas > 0].min() < 5:
+        return parse_gsr_csv_rows(raw[start:])
+    field_start = commas[first_comma+3] + 1
+    field_end = commas[first_comma+4]
+
+    # decode the fields one character column at a time: value = mantissa/10^decimals
+    mantissa = np.zeros(len(field_start), dtype=np.int64)
+    scale = np.ones(len(field_start))
+    seen_dot = np.zeros(len(field_start), dtype=bool)
+    for i in range((field_end - field_start).max()):
+        in_field = field_start + i < field_end
+        char = body[np.minimum(field_start + i, len(body)-1)]
+        digit = char - np.uint8(ord('0'))
+        is_digit = in_field & (digit < 10)
+        is_dot = in_field & (char == ord('.'))
+        if np.any(in_field & ~is_digit & ~is_dot) or np.any(is_dot & seen_dot):
+            return parse_gsr_csv_rows(raw[start:]) # not a plain decimal number
+        mantissa = np.where(is_digit, mantissa*10 + digit, mantissa)
+        scale[is_digit & seen_dot] *= 10
+        seen_dot |= is_dot
+    solar_radiation = mantissa/scale # blank fields stay 0
+    return solar_radiation
+
+def parse_gsr_csv_rows(body):
+    # slow but general fallback: parse the GSR field of each row with float()
+    solar_radiation = [float(row.split(b',')[4] or 'nan') for row in body.splitlines() if row.strip()]
+    solar_radiation = np.array(solar_radiation)
+    solar_radiation[np.isnan(solar_radiation)] = 0 # convert missing data in CSV files to zero
+    return solar_radiation
+########################################################
+
+########################################################
+# On-disk cache of decoded GSR traces
+########################################################
+# Each decoded trace is stored as solar_cache/<location>_<year>_<key>.npy
+# The key hashes location, year, SMAX and the mtime/size of the source CSV,
+# so editing or replacing a CSV invalidates its cached copy automatically.
+GSR_CACHE_DIR = 'solar_cache'
+
+def gsr_cache_file(sfile, location, year, SMAX):
+    stat = sfile.stat()
+    key = "{}/{}/{!r}/{}/{}".format(location, year, float(SMAX), stat.st_mtime_ns, stat.st_size)
+    key = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return Path.cwd() / GSR_CACHE_DIR / "{}_{}_{}.npy".format(location, year, key)
+
+def save_gsr_cache(cfile, henergy):
+    cfile.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first so that concurrent readers never see a partial file
+    tmp_file = cfile.with_name(cfile.name + ".{}.tmp".format(os.getpid()))
+    with open(tmp_file, 'wb') as f:
+        np.save(f, henergy)
+    os.replace(tmp_file, cfile)
+########################################################
+
+########################################################
+# Consolidated solar archive
+########################################################
+# All solar_data/<location>/<year>.csv files packed into
+#   solar_data/solar_archive.npy  : raw GSR values of every trace, concatenated (float64)
+#   solar_data/solar_archive.json : "<location>/<year>" -> [offset, length, mtime_ns, size of the CSV]
+# The .npy file is memory-mapped, so every process reading it shares the same page cache
+# (csv2gsr still copies each trace it reads once, when normalizing by SMAX).
+# Build it once with:  python -m common.build_solar_archive
+# A CSV whose mtime or size no longer matches the index is parsed again instead; rebuild the
+# archive after editing CSVs under solar_data/ to bring them back into it.
+SOLAR_ARCHIVE_NAME = 'solar_archive'
+_SOLAR_ARCHIVES = {} # archive path -> (memmap, index), loaded once per process
+
+def archive_key(location, year):
+    return "{}/{}".format(location, year)
+
+def solar_archive_files(solar_dir=None):
+    solar_dir = Path.cwd() / 'solar_data' if solar_dir is None else Path(solar_dir)
+    return solar_dir / (SOLAR_ARCHIVE_NAME + '.npy'), solar_dir / (SOLAR_ARCHIVE_NAME + '.json')
+
+def load_solar_archive(solar_dir=None):
+    data_file, index_file = solar_archive_files(solar_dir)
+    if data_file not in _SOLAR_ARCHIVES:
+        if not (data_file.exists() and index_file.exists()):
+            return None # archive not built
+        with open(index_file) as f:
+            index = {key: tuple(entry) for key, entry in json.load(f).items()}
+        _SOLAR_ARCHIVES[data_file] = (np.load(data_file, mmap_mode='r'), index)
+    return _SOLAR_ARCHIVES[data_file]
+
+def solar_archive_trace(sfile, location, year):
+    # raw GSR values of sfile in the archive, or None if the archive is not built,
+    # does not contain the trace or was built from a different version of the CSV
+    archive = load_solar_archive(sfile.parent.parent)
+    if archive is None:
+        return None
+    archive_data, archive_index = archive
+    entry = archive_index.get(archive_key(location, year))
+    if entry is None or len(entry) < 4:
+        return None
+    offset, length, mtime_ns, size = entry
+    try:
+        stat = sfile.stat()
+    except FileNotFoundError:
+        return archive_data[offset:offset+length] # the archive is the only copy left
+    if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+        return None # the CSV has changed since the archive was built
+    return archive_data[offset:offset+length]
+
+def build_solar_archive(solar_dir=None):
+    solar_dir = Path.cwd() / 'solar_data' if solar_dir is None else Path(solar_dir)
+    data_file, index_file = solar_archive_files(solar_dir)
+
+    traces = []
+    index = {}
+    offset = 0
+    for sfile in sorted(solar_dir.glob('*/*.csv')):
+        stat = sfile.stat()
+        solar_radiation = parse_gsr_csv(sfile)
+        index[archive_key(sfile.parent.name, sfile.stem)] = [offset, len(solar_radiation),
+                                                             stat.st_mtime_ns, stat.st_size]
+        offset += len(solar_radiation)
+        traces.append(solar_radiation)
+
+    tmp_file = data_file.with_name(data_file.name + ".{}.tmp".format(os.getpid()))
+    with open(tmp_file, 'wb') as f:
+        np.save(f, np.concatenate(traces).astype(np.float64))
+    os.replace(tmp_file, data_file)
+    tmp_file = index_file.with_name(index_file.name + ".{}.tmp".format(os.getpid()))
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f, indent=0, sort_keys=True)
+    os.replace(tmp_file, index_file)
+
+    _SOLAR_ARCHIVES.pop(data_file, None) # drop any stale copy loaded by this process
+    return index
+########################################################
+
+########################################################
+# Bulk loading of many (location, year) traces
+########################################################
+def list_solar_traces(solar_dir=None):
+    # all (location, year) pairs available under solar_data/
+    solar_dir = Path.cwd() / 'solar_data' if solar_dir is None else Path(solar_dir)
+    traces = []
+    for sfile in sorted(solar_dir.glob('*/*.csv')):
+        year = int(sfile.stem) if sfile.stem.isdigit() else sfile.stem
+        traces.append((sfile.parent.name, year))
+    return traces
+
+def _csv2gsr_star(args):
+    return csv2gsr(*args)
+
+def load_solar_traces(traces=None, SMAX=4.0, PROCESSES=None, USE_CACHE=True):
+    # Returns {(location, year): henergy} for every requested trace.
+    # traces=None loads everything under solar_data/.
+    # CSVs are parsed concurrently across a pool of PROCESSES worker processes (default: all cores),
+    # so a cold load is bounded by the number of cores rather than the number of files.
+    traces = list_solar_traces() if traces is None else [tuple(trace) for trace in traces]
+    args = [(location, year, SMAX, USE_CACHE) for location, year in traces]
+
+    if (USE_CACHE and load_solar_archive() is not None) or len(traces) <= 1: # already cheap, no need for a pool
+        return {trace: csv2gsr(*arg) for trace, arg in zip(traces, args)}
+
+    PROCESSES = os.cpu_count() if PROCESSES is None else PROCESSES
+    PROCESSES = max(1, min(PROCESSES, len(traces)))
+    chunksize = max(1, len(traces)//(4*PROCESSES))
+    with ProcessPoolExecutor(max_workers=PROCESSES) as pool:
+        henergy_list = list(pool.map(_csv2gsr_star, args, chunksize=chunksize))
+    for henergy in henergy_list:
+        henergy.setflags(write=False) # read-only as returned by csv2gsr (unpickling made them writable)
+    return dict(zip(traces, henergy_list))
+########################################################
     
 ########################################################
 # Class for solar energy harvester
@@ -46,98 +263,367 @@ class csv_solar_harvester(object):
                  NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
                  REQ_TIMESLOTS_PER_DAY=240, # no. of timeslots per day
                  PREDICTION_HORIZON=240, # lookahead horizon to predict energy
-                 PENERGY_NOISE=0.005): # preidction noise
+                 PENERGY_NOISE=0.005, # preidction noise
+                 NOISE_BANK=None, # optional trace_noise_bank to take the noise from
+                 PREDICTOR='rolling', # energy predictor, one of PREDICTORS
+                 RNG=None): # random generator for the noise (default: the global np.random)
         
       
         # Initialize variables
+        self.rng = np.random if RNG is None else RNG
         self.day = 0
         self.global_time = 0
         self.henergy_stream = []
         self.penergy_stream = []
         
-        henergy = csv2gsr(location,year,SMAX)
-        henergy = henergy.reshape(-1, READINGS_PER_DAY)
-        # Fix time resolution
-        ######################
-        self.no_of_days = int(henergy.shape[0]/READINGS_PER_DAY) # the number of days worth of data in the csv file
-
-        # Interpolate the harvested energy data to new time resolution
-        ###############################################################
-        itp_henergy = interp1d(np.arange(READINGS_PER_DAY),
-                               henergy, 
-                               kind='quadratic') # quadratic interpolation
-        
-        new_time_slots =  np.linspace(0, READINGS_PER_DAY-1, REQ_TIMESLOTS_PER_DAY) # new time index
-        high_res_henergy = itp_henergy(new_time_slots) # interpolate and fill in the intermediate values
-        self.time_slots = new_time_slots # to access from object instance
+        # Deterministic base trace (CSV >> normalize >> interpolate), shared across resets
+        ##################################################################################
+        self.time_slots, base_henergy = solar_base_trace(location, year, READINGS_PER_DAY, SMAX, REQ_TIMESLOTS_PER_DAY)
+        self.time_slots = self.time_slots.copy() # to access from object instance
+        self.no_of_days = base_henergy.shape[0] # the number of days worth of data in the csv file
+        base_henergy = base_henergy.reshape(-1)
     
+        # Stochastic overlay: one vectorized noise draw per reset
+        #########################################################
+        if NOISE_BANK is None:
+            henergy_noise = self.rng.normal(1,HENERGY_NOISE,size=base_henergy.shape) # add some noise to it
+            penergy_noise = self.rng.normal(0,PENERGY_NOISE,size=base_henergy.shape) # prediction noise
+        else:
+            henergy_noise, penergy_noise = NOISE_BANK.draw(base_henergy.shape[0])
+
         # Add noise to henergy data
         ###########################
-        henergy_noise = np.random.normal(1,HENERGY_NOISE,size=high_res_henergy.shape) # add some noise to it
-        high_res_henergy *= henergy_noise # we multiply so that zero energy times slots remain with zero energy
+        high_res_henergy = base_henergy * henergy_noise # we multiply so that zero energy times slots remain with zero energy
         high_res_henergy[high_res_henergy<NORMALIZED_HMIN_THRES]=0 # clipping threshold
         high_res_henergy[high_res_henergy>1]=1
-        self.henergy_stream = high_res_henergy.reshape(1,-1).flatten().tolist() # flattened list of henergy
+        self.henergy_stream = high_res_henergy # flattened array of henergy
 
         # Get energy prediction
         #######################
-        self.predictor = rolling_predictor(PREDICTION_HORIZON, PENERGY_NOISE)
-        self.penergy_stream = self.predictor.get_prediction(self.henergy_stream)
+        # the predictor sees the noisy henergy, so it is part of the overlay
+        self.predictor = PREDICTORS[PREDICTOR](PREDICTION_HORIZON, PENERGY_NOISE)
+        self.penergy_stream = self.predictor.get_prediction(high_res_henergy, penergy_noise)
         self.penergy_stream[self.penergy_stream<NORMALIZED_HMIN_THRES]=0 # clipping threshold
-        self.penergy_stream = self.penergy_stream.tolist()
+
+        self.build_step_arrays()
     
+    def build_step_arrays(self):
+        # Precompute everything step() returns, once per harvester
+        ############################################################
+        # time_stream, henergy_stream, penergy_stream : float64 arrays, one entry per timeslot
+        # day_end_stream, harvester_end_stream        : boolean masks of the last slot of each day / of the trace
+        # The arrays serve block access (get_block); step() reads the same values from plain lists,
+        # since indexing a list of Python floats is cheaper than indexing an array one element at a time.
+        time_index = np.arange(len(self.henergy_stream)) % len(self.time_slots)
+        self.time_stream = self.time_slots[time_index]
+        self.day_end_stream = time_index == len(self.time_slots)-1
+        self.harvester_end_stream = np.zeros(len(self.henergy_stream), dtype=bool)
+        self.harvester_end_stream[-1] = True
+        self.last_time = len(self.henergy_stream)-1
+
+        self.time_list = self.time_stream.tolist()
+        self.henergy_list = self.henergy_stream.tolist()
+        self.penergy_list = self.penergy_stream.tolist()
+        self.day_end_list = self.day_end_stream.tolist()
+
     # step through each time step and output time, henergy, penergy
     def step(self):
-        if self.global_time < len(self.henergy_stream)-1:
-            HARVESTER_END = False
-            DAY_END = False
+        if self.global_time < self.last_time:
             self.global_time += 1 # new time
-            time = self.time_slots[self.global_time%len(self.time_slots)]
-            henergy = self.henergy_stream[self.global_time]
-            penergy = self.penergy_stream[self.global_time]
-            if self.global_time%len(self.time_slots)==len(self.time_slots)-1:
+            global_time = self.global_time
+            DAY_END = self.day_end_list[global_time]
+            if DAY_END:
 #                 print("END OF DAY:", self.day)
                 self.day += 1
-                DAY_END = True
-            if self.global_time == len(self.henergy_stream)-1:
-#                 print("END OF YEAR. DAY:",self.day)
-                HARVESTER_END = True
-            return time, henergy, penergy, DAY_END, HARVESTER_END
+            HARVESTER_END = global_time == self.last_time
+            return self.time_list[global_time], self.henergy_list[global_time], self.penergy_list[global_time], DAY_END, HARVESTER_END
         else:
             print("YEAR ALREADY ENDED")
             DAY_END = True
             HARVESTER_END = True
             return -1,-1,-1,DAY_END, HARVESTER_END
+
+    # block access to the timeslots ahead of the cursor
+    def get_block(self, length):
+        # time, henergy, penergy, DAY_END and HARVESTER_END of the next `length` timeslots
+        # (the values the next `length` calls of step() would return), as array slices.
+        # The cursor is not moved; call skip() to consume the block.
+        start = self.global_time + 1
+        stop = min(start + length, self.last_time + 1)
+        return (self.time_stream[start:stop],
+                self.henergy_stream[start:stop],
+                self.penergy_stream[start:stop],
+                self.day_end_stream[start:stop],
+                self.harvester_end_stream[start:stop])
+
+    def skip(self, length):
+        # advance the cursor by `length` timeslots, as if step() had been called `length` times
+        stop = min(self.global_time + length, self.last_time)
+        self.day += int(np.count_nonzero(self.day_end_stream[self.global_time+1:stop+1]))
+        self.global_time = stop
+
+    # snapshot/restore of the cursor; the traces are shared, never copied
+    def get_state(self):
+        return (self.global_time, self.day)
+
+    def set_state(self, state):
+        self.global_time, self.day = state
+
+    def clone(self):
+        return copy.copy(self) # own cursor, same traces
 # End of csv_solar_harvester
 ########################################################
 
 ########################################################
-# random_day_env: harvester outputs energy for random days
+# Multi-year harvester: consecutive years as one continuous trace
 ########################################################
-class csv_solar_harvester_random(csv_solar_harvester):
-# random_day_env
-# step through each time step and output time, henergy, penergy
-    def step(self):
-        HARVESTER_END = False
-        DAY_END = False
-        self.global_time += 1 # new time
-        time_index = self.global_time%len(self.time_slots)
-        time = self.time_slots[time_index]
-        if time_index==0: # if beginning of time slot 
-            self.day = np.random.choice(self.no_of_days, replace=False) # pick a random day
-#             print("BEGINNING OF DAY:", self.day)
-        day_start_index = self.day*len(self.time_slots)
-        henergy = self.henergy_stream[day_start_index+time_index]
-        penergy = self.penergy_stream[day_start_index+time_index]
-        
-        if time == self.time_slots[-1]: #if end of time slot,
-            DAY_END = True
+class csv_solar_harvester_multiyear(object):
+    # Streams the years of `years` (e.g. range(1995, 2019)) back to back as one trace.
+    # Only the year under the cursor is held in memory: the next year is built (as a
+    # csv_solar_harvester) when the cursor is within LOAD_AHEAD timeslots of the year end,
+    # and the old year is released once the cursor crosses the boundary.
+    # step() behaves like csv_solar_harvester.step(); HARVESTER_END is only raised at the end of the last year.
+    # get_block()/skip() work within the current year; call them again after crossing into the next one.
+    def __init__(self, 
+                 location='tokyo',
+                 years=range(1995, 2019),
+                 LOAD_AHEAD=None, # timeslots before the year end at which the next year is loaded (default: one day)
+                 **harvester_kwargs): # passed on to csv_solar_harvester
+        self.location = location
+        self.years = list(years)
+        self.harvester_kwargs = harvester_kwargs
         
-        if self.global_time == len(self.henergy_stream)-1: # All days have been experienced
-            HARVESTER_END = True
-#             print("END OF YEAR")
+        # Initialize variables
+        self.day = 0
+        self.global_time = 0
+        self.year_index = 0
+        self.year_harvester = csv_solar_harvester(location, self.years[0], **harvester_kwargs)
+        self.next_year_harvester = None
+        self.time_slots = self.year_harvester.time_slots
+        self.LOAD_AHEAD = len(self.time_slots) if LOAD_AHEAD is None else LOAD_AHEAD
+        # days of each year as found in its data (some CSVs do not span their calendar year),
+        # counted without loading the years, which are only loaded as the cursor reaches them
+        READINGS_PER_DAY = harvester_kwargs.get('READINGS_PER_DAY', 24)
+        SMAX = harvester_kwargs.get('SMAX', 4.0)
+        self.no_of_days = sum(gsr_trace_length(location, year, SMAX)//READINGS_PER_DAY for year in self.years)
+        self.last_time = self.no_of_days*len(self.time_slots) - 1 # global_time of the last timeslot of the trace
+
+    def load_next_year(self):
+        if self.next_year_harvester is None and self.year_index + 1 < len(self.years):
+            self.next_year_harvester = csv_solar_harvester(self.location, self.years[self.year_index+1], **self.harvester_kwargs)
+            self.next_year_harvester.global_time = -1 # start the new year from its first timeslot
+
+    def next_year(self):
+        self.load_next_year()
+        self.year_harvester = self.next_year_harvester # the previous year is released here
+        self.next_year_harvester = None
+        self.year_index += 1
+
+    def is_last_year(self):
+        return self.year_index == len(self.years) - 1
 
+    def step(self):
+        year_harvester = self.year_harvester
+        if year_harvester.global_time >= year_harvester.last_time and not self.is_last_year():
+            self.next_year()
+            year_harvester = self.year_harvester
+        time, henergy, penergy, DAY_END, HARVESTER_END = year_harvester.step()
+        if year_harvester.global_time == year_harvester.last_time - self.LOAD_AHEAD:
+            self.load_next_year()
+        if time != -1: # i.e. the last year had not already ended
+            self.global_time += 1
+            if DAY_END:
+                self.day += 1
+        if HARVESTER_END and not self.is_last_year():
+            HARVESTER_END = False # the trace continues into the next year
         return time, henergy, penergy, DAY_END, HARVESTER_END
+
+    def get_block(self, length):
+        time, henergy, penergy, day_end, harvester_end = self.year_harvester.get_block(length)
+        if not self.is_last_year():
+            harvester_end = np.zeros_like(harvester_end)
+        return time, henergy, penergy, day_end, harvester_end
+
+    def skip(self, length):
+        # skips at most to the end of the current year
+        year_harvester = self.year_harvester
+        start_time, start_day = year_harvester.global_time, year_harvester.day
+        year_harvester.skip(length)
+        self.global_time += year_harvester.global_time - start_time
+        self.day += year_harvester.day - start_day
+        if year_harvester.global_time >= year_harvester.last_time - self.LOAD_AHEAD:
+            self.load_next_year()
+
+    # snapshot/restore of the cursor: the year harvesters are referenced, not copied.
+    # A next year loaded after the snapshot is kept on restore, so that every branch sees the same trace.
+    def get_state(self):
+        next_year_state = None if self.next_year_harvester is None else self.next_year_harvester.get_state()
+        return (self.global_time, self.day, self.year_index,
+                self.year_harvester, self.year_harvester.get_state(),
+                self.next_year_harvester, next_year_state)
+
+    def set_state(self, state):
+        loaded = {self.year_index: self.year_harvester, self.year_index+1: self.next_year_harvester}
+        (self.global_time, self.day, self.year_index,
+         self.year_harvester, year_state,
+         self.next_year_harvester, next_year_state) = state
+        self.year_harvester.set_state(year_state)
+        if self.next_year_harvester is not None:
+            self.next_year_harvester.set_state(next_year_state)
+        elif loaded.get(self.year_index+1) is not None:
+            self.next_year_harvester = loaded[self.year_index+1]
+            self.next_year_harvester.set_state((-1, 0)) # as loaded by load_next_year()
+
+    def clone(self):
+        clone = copy.copy(self)
+        clone.year_harvester = self.year_harvester.clone()
+        if self.next_year_harvester is not None:
+            clone.next_year_harvester = self.next_year_harvester.clone()
+        return clone
+# End of csv_solar_harvester_multiyear
+########################################################
+
+########################################################
+# Background prefetch of the next episode's harvester
+########################################################
+class harvester_prefetcher(object):
+    # Double buffer for training loops that reset over a known (location, year) schedule.
+    # get() hands out the harvester of the current reset and starts building the harvester
+    # of the next scheduled episode in a background thread, so the next reset only swaps it in.
+    # A thread is used rather than a process: building a harvester is mostly numpy work that
+    # releases the GIL, and a process would have to pickle the whole trace back.
+    # The noise is drawn from the prefetcher's own RandomState (seeded with SEED), so the traces
+    # do not depend on when the thread runs relative to the np.random calls of the training loop.
+    # The first reset, and any reset that is off the schedule, builds its harvester synchronously.
+    # Use it as a context manager so that the worker thread is shut down with the training loop:
+    #     with env.prefetch_harvesters(schedule, SEED=0):
+    #         for location, year in schedule:
+    #             obs = env.reset(location, year)
+    #             ...
+    # Once closed, it builds every harvester synchronously.
+    def __init__(self, schedule, SEED=None):
+        self.schedule = list(schedule) # [(location, year), ...] in the order of the resets
+        self.position = 0 # index in schedule of the next episode
+        self.rng = np.random.RandomState(SEED)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None # (location, year), future of the harvester being built
+
+    def get(self, location, year, build):
+        # build(location, year, RNG=...) makes a harvester; it is also used for the prefetch
+        harvester = None
+        if self.pending is not None:
+            pending_key, future = self.pending
+            self.pending = None
+            prefetched = future.result() # wait for it even if unused, the RNG draws stay in order
+            if pending_key == (location, year):
+                harvester = prefetched
+        if harvester is None:
+            harvester = build(location, year, RNG=self.rng)
+        if self.position < len(self.schedule) and self.schedule[self.position] == (location, year):
+            self.position += 1
+        if self.position < len(self.schedule) and self.executor is not None:
+            next_location, next_year = self.schedule[self.position]
+            self.pending = ((next_location, next_year), self.executor.submit(build, next_location, next_year, RNG=self.rng))
+        return harvester
+
+    def close(self, wait=True):
+        if self.pending is not None:
+            self.pending[1].cancel()
+            self.pending = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self): # fallback for a prefetcher that was never closed
+        if getattr(self, 'executor', None) is not None:
+            self.close(wait=False)
+# End of harvester_prefetcher
+########################################################
+
+########################################################
+# Deterministic base trace and noise bank for the harvester
+########################################################
+@functools.lru_cache(maxsize=32)
+def solar_base_trace(location, year, READINGS_PER_DAY, SMAX, REQ_TIMESLOTS_PER_DAY):
+    # CSV >> normalize >> interpolate, i.e. everything in csv_solar_harvester that does not depend on the noise.
+    # Cached per (location, year, resolution), so repeated resets only pay for the noise overlay.
+    # Returns time_slots and a read-only no_of_days x REQ_TIMESLOTS_PER_DAY matrix of henergy.
+    henergy = csv2gsr(location,year,SMAX)
+    henergy = henergy.reshape(-1, READINGS_PER_DAY)
+    new_time_slots, interp_basis = quadratic_interp_basis(READINGS_PER_DAY, REQ_TIMESLOTS_PER_DAY)
+    high_res_henergy = henergy @ interp_basis # quadratic interpolation of every day in one matmul
+    high_res_henergy.setflags(write=False) # shared between harvesters
+    return new_time_slots, high_res_henergy
+
+class trace_noise_bank(object):
+    # Pre-draws the henergy/penergy noise of NO_OF_EPISODES resets in one vectorized call
+    # and hands it out one episode at a time, redrawing when the bank runs out.
+    # There is one bank per trace length, so alternating 365- and 366-day years only
+    # redraw each bank once every NO_OF_EPISODES resets of that length.
+    # Envs take it from their harvester_noise_bank attribute; it replaces their harvester_rng.
+    def __init__(self, HENERGY_NOISE=0.1, PENERGY_NOISE=0.005, NO_OF_EPISODES=16, RNG=np.random):
+        self.HENERGY_NOISE = HENERGY_NOISE
+        self.PENERGY_NOISE = PENERGY_NOISE
+        self.NO_OF_EPISODES = NO_OF_EPISODES
+        self.rng = RNG
+        self.banks = {} # trace length -> [henergy_noise, penergy_noise, next_episode]
+
+    def refill(self, size):
+        self.banks[size] = [self.rng.normal(1,self.HENERGY_NOISE,size=(self.NO_OF_EPISODES,size)),
+                            self.rng.normal(0,self.PENERGY_NOISE,size=(self.NO_OF_EPISODES,size)),
+                            0]
+
+    def draw(self, size):
+        if size not in self.banks or self.banks[size][2] >= self.NO_OF_EPISODES:
+            self.refill(size)
+        bank = self.banks[size]
+        episode = bank[2]
+        bank[2] += 1
+        return bank[0][episode], bank[1][episode]
+########################################################
+
+########################################################
+# Quadratic interpolation as a precomputed linear operator
+########################################################
+@functools.lru_cache(maxsize=None)
+def quadratic_interp_basis(READINGS_PER_DAY, REQ_TIMESLOTS_PER_DAY):
+    # Quadratic spline interpolation is linear in the data, so interpolating a day of readings
+    # from READINGS_PER_DAY points onto REQ_TIMESLOTS_PER_DAY points is a fixed matrix:
+    #   day_matrix @ interp_basis == interp1d(arange(READINGS_PER_DAY), day_matrix, kind='quadratic')(new_time_slots)
+    # Row i of interp_basis is the interpolant of the i-th unit vector.
+    # The basis is built once per resolution pair; scipy is only needed here.
+    from scipy.interpolate import interp1d
+    new_time_slots =  np.linspace(0, READINGS_PER_DAY-1, REQ_TIMESLOTS_PER_DAY) # new time index
+    interp_basis = interp1d(np.arange(READINGS_PER_DAY),
+                            np.eye(READINGS_PER_DAY),
+                            kind='quadratic')(new_time_slots)
+    new_time_slots.setflags(write=False) # shared between harvesters
+    interp_basis.setflags(write=False)
+    return new_time_slots, interp_basis
+########################################################
+
+########################################################
+# random_day_env: harvester outputs energy for random days
+########################################################
+class csv_solar_harvester_random(csv_solar_harvester):
+# random_day_env
+# The days of the trace are replayed in a random order. One permutation of the days is drawn
+# per episode (day_order), so every day is visited exactly once and step() needs no RNG calls.
+# self.day counts the days played so far; the calendar day being played is day_order[self.day].
+    def build_step_arrays(self):
+        TIMESLOTS_PER_DAY = len(self.time_slots)
+        self.day_order = self.rng.permutation(self.no_of_days) # pick the order of the days
+        self.step_index = (self.day_order[:,None]*TIMESLOTS_PER_DAY + np.arange(TIMESLOTS_PER_DAY)).reshape(-1)
+        # reorder the streams so that the harvester simply walks through them
+        self.henergy_stream = self.henergy_stream[self.step_index]
+        self.penergy_stream = self.penergy_stream[self.step_index]
+        super(csv_solar_harvester_random, self).build_step_arrays()
 # End of csv_solar_harvester_random
 ########################################################
 
@@ -149,19 +635,76 @@ class rolling_predictor(object):
             self.PREDICTION_HORIZON = PREDICTION_HORIZON
             self.PENERGY_NOISE = PENERGY_NOISE
             
-        def get_prediction(self, henergy_stream):
-            PREDICTION_HORIZON = self.PREDICTION_HORIZON
+        def get_prediction(self, henergy_stream, penergy_noise=None):
             PENERGY_NOISE = self.PENERGY_NOISE
-          # this uses a simple rolling average over a given prediction horizon
-            weights = np.ones(PREDICTION_HORIZON) / PREDICTION_HORIZON
-            penergy = np.convolve(henergy_stream, weights, mode='same')
-            penergy_noise = np.random.normal(0,PENERGY_NOISE,size=penergy.shape) # add noise
+            penergy = self.forecast(np.asarray(henergy_stream, dtype=np.float64))
+            if penergy_noise is None:
+                penergy_noise = np.random.normal(0,PENERGY_NOISE,size=penergy.shape) # add noise
             penergy += penergy_noise
             penergy /= penergy.max()
             penergy_stream = penergy.reshape(1,-1).flatten() # flattened list of penergy
             return penergy_stream
+
+        def forecast(self, henergy):
+          # this uses a simple rolling average over a given prediction horizon
+          # centred like np.convolve(henergy, ones(PREDICTION_HORIZON)/PREDICTION_HORIZON, mode='same'),
+          # but computed from a cumulative sum in O(n) independent of the horizon
+            PREDICTION_HORIZON = min(self.PREDICTION_HORIZON, len(henergy))
+            csum = np.concatenate(([0.0], np.cumsum(henergy)))
+            index = np.arange(len(henergy))
+            window_end = np.minimum(index + (PREDICTION_HORIZON-1)//2 + 1, len(henergy))
+            window_start = np.maximum(index - PREDICTION_HORIZON//2, 0)
+            return (csum[window_end] - csum[window_start]) / self.PREDICTION_HORIZON
 # End of rolling_predictor
 ########################################################
+########################################################
+class trailing_predictor(rolling_predictor):
+    def forecast(self, henergy):
+        # causal mean over the last PREDICTION_HORIZON timeslots (fewer at the start of the trace)
+        csum = np.concatenate(([0.0], np.cumsum(henergy)))
+        index = np.arange(1, len(henergy)+1)
+        window_start = np.maximum(index - self.PREDICTION_HORIZON, 0)
+        return (csum[index] - csum[window_start]) / (index - window_start)
+# End of trailing_predictor
+########################################################
+########################################################
+class persistence_predictor(rolling_predictor):
+    def forecast(self, henergy):
+        # tomorrow looks like today: henergy of the same timeslot PREDICTION_HORIZON slots ago
+        # (the first PREDICTION_HORIZON slots have no history and use the observed henergy)
+        penergy = henergy.copy()
+        penergy[self.PREDICTION_HORIZON:] = henergy[:-self.PREDICTION_HORIZON]
+        return penergy
+# End of persistence_predictor
+########################################################
+########################################################
+class ewma_predictor(rolling_predictor):
+    def forecast(self, henergy):
+        # exponentially weighted moving average with span PREDICTION_HORIZON:
+        #   y[i] = (1-alpha)*y[i-1] + alpha*x[i],  y[0] = x[0],  alpha = 2/(PREDICTION_HORIZON+1)
+        # evaluated in closed form, y[s+j] = d^(j+1)*y[s-1] + alpha*d^j*cumsum(x[s+m]*d^-m),  d = 1-alpha,
+        # over blocks short enough for d^-m not to overflow
+        alpha = 2/(self.PREDICTION_HORIZON+1)
+        decay = 1 - alpha
+        block = len(henergy) if decay == 1 else max(1, int(300/-np.log(decay)))
+        penergy = np.empty_like(henergy)
+        y_prev = henergy[0] if len(henergy) else 0.0
+        for start in range(0, len(henergy), block):
+            x = henergy[start:start+block]
+            powers = decay ** np.arange(len(x))
+            penergy[start:start+len(x)] = decay*powers*y_prev + alpha*powers*np.cumsum(x/powers)
+            y_prev = penergy[start+len(x)-1]
+        return penergy
+# End of ewma_predictor
+########################################################
+# Predictors selectable with csv_solar_harvester(PREDICTOR=...)
+PREDICTORS = {
+    'rolling':     rolling_predictor,
+    'trailing':    trailing_predictor,
+    'persistence': persistence_predictor,
+    'ewma':        ewma_predictor,
+}
+########################################################
 
 ########################################################
 # Class for utility generation
@@ -253,7 +796,258 @@ class battery(object):
 # End of class battery
 ########################################################
 
+########################################################
+# Class for environment logging
+########################################################
+LOG_MODES = ('off', 'daily', 'full')
+DAILY_LOG_DTYPE = [('benergy', np.float64),    # mean battery observation of the day
+                   ('eno', np.float64),        # sum of eno_log over the day
+                   ('recovery', np.int64),     # timeslots spent in recovery mode
+                   ('duty_cycle', np.float64)] # mean duty cycle of the timeslots not in recovery
+
+def grow_log_column(column):
+    # doubles the length of a log column, keeping its contents
+    grown = np.zeros((max(1, 2*len(column)),) + column.shape[1:], dtype=column.dtype)
+    grown[:len(column)] = column
+    return grown
+
+class env_logger(object):
+    # Logs of one episode in preallocated columns, sized from the trace (CAPACITY timeslots)
+    # and grown if they run out. LOG_MODE:
+    #   'full'  (or True)  : every observation (env_log), action (action_log, -1 in recovery) and eno value (eno_log)
+    #   'daily'            : one DAILY_LOG_DTYPE row per day (daily_log)
+    #   'off'   (or False) : nothing
+    # env_log, action_log and eno_log are views of the filled part of the columns, not copies.
+    def __init__(self, LOG_MODE, CAPACITY, OBS_SIZE, TIMESLOTS_PER_DAY):
+        if LOG_MODE is True:
+            LOG_MODE = 'full'
+        elif LOG_MODE is False or LOG_MODE is None:
+            LOG_MODE = 'off'
+        assert LOG_MODE in LOG_MODES, 'Invalid log mode'
+        self.LOG_MODE = LOG_MODE
+
+        FULL_CAPACITY = CAPACITY if LOG_MODE == 'full' else 0
+        self.obs_col = np.zeros((FULL_CAPACITY, OBS_SIZE))
+        self.action_col = np.zeros(FULL_CAPACITY)
+        self.eno_col = np.zeros(FULL_CAPACITY)
+        self.obs_len = 0
+        self.action_len = 0
+
+        DAILY_CAPACITY = CAPACITY//TIMESLOTS_PER_DAY + 1 if LOG_MODE == 'daily' else 0
+        self.daily_col = np.zeros(DAILY_CAPACITY, dtype=DAILY_LOG_DTYPE)
+        self.day_len = 0
+        self.new_day() # running sums of the current day
+        self.PREV_DAY_END = False
+
+    def log_obs(self, obs, DAY_END):
+        if self.LOG_MODE == 'full':
+            if self.obs_len == len(self.obs_col):
+                self.obs_col = grow_log_column(self.obs_col)
+            self.obs_col[self.obs_len] = obs
+            self.obs_len += 1
+        elif self.LOG_MODE == 'daily':
+            # the action taken on the last timeslot of a day still belongs to that day,
+            # so the day is closed on the first observation of the next one
+            if self.PREV_DAY_END:
+                self.close_day()
+            self.day_benergy += obs[3]
+            self.day_obs += 1
+            self.PREV_DAY_END = DAY_END
+
+    def log_action(self, action, eno):
+        if self.LOG_MODE == 'full':
+            if self.action_len == len(self.action_col):
+                self.action_col = grow_log_column(self.action_col)
+                self.eno_col = grow_log_column(self.eno_col)
+            self.action_col[self.action_len] = action
+            self.eno_col[self.action_len] = eno
+            self.action_len += 1
+        elif self.LOG_MODE == 'daily':
+            self.day_eno += eno
+            if action == -1:
+                self.day_recovery += 1
+            else:
+                self.day_duty_cycle += action
+                self.day_actions += 1
+
+    def log_block(self, action, eno, obs, DAY_END):
+        # action[k], eno[k] and then obs[k], DAY_END[k] for k = 0..len(obs)-1,
+        # i.e. the logs of len(obs) consecutive steps
+        if self.LOG_MODE == 'full':
+            length = len(obs)
+            while self.obs_len + length > len(self.obs_col):
+                self.obs_col = grow_log_column(self.obs_col)
+            while self.action_len + length > len(self.action_col):
+                self.action_col = grow_log_column(self.action_col)
+                self.eno_col = grow_log_column(self.eno_col)
+            self.action_col[self.action_len:self.action_len+length] = action
+            self.eno_col[self.action_len:self.action_len+length] = eno
+            self.action_len += length
+            self.obs_col[self.obs_len:self.obs_len+length] = obs
+            self.obs_len += length
+        elif self.LOG_MODE == 'daily':
+            for k in range(len(obs)):
+                self.log_action(action[k], eno[k])
+                self.log_obs(obs[k], DAY_END[k])
+
+    def new_day(self):
+        self.day_benergy = 0.0
+        self.day_obs = 0
+        self.day_eno = 0.0
+        self.day_recovery = 0
+        self.day_duty_cycle = 0.0
+        self.day_actions = 0
+
+    def day_summary(self):
+        return (self.day_benergy/max(1,self.day_obs),
+                self.day_eno,
+                self.day_recovery,
+                self.day_duty_cycle/self.day_actions if self.day_actions else np.nan)
+
+    def close_day(self):
+        if self.day_len == len(self.daily_col):
+            self.daily_col = grow_log_column(self.daily_col)
+        self.daily_col[self.day_len] = self.day_summary()
+        self.day_len += 1
+        self.new_day()
+
+    # snapshot/restore of the log lengths and the running sums of the day; entries logged
+    # after a snapshot are dropped by set_state() and overwritten by the next ones
+    def get_state(self):
+        return (self.obs_len, self.action_len, self.day_len, self.PREV_DAY_END,
+                self.day_benergy, self.day_obs, self.day_eno, self.day_recovery, self.day_duty_cycle, self.day_actions)
+
+    def set_state(self, state):
+        (self.obs_len, self.action_len, self.day_len, self.PREV_DAY_END,
+         self.day_benergy, self.day_obs, self.day_eno, self.day_recovery, self.day_duty_cycle, self.day_actions) = state
+
+    @property
+    def env_log(self):
+        return self.obs_col[:self.obs_len]
+
+    @property
+    def action_log(self):
+        return self.action_col[:self.action_len]
+
+    @property
+    def eno_log(self):
+        return self.eno_col[:self.action_len]
+
+    @property
+    def daily_log(self):
+        # closed days are a view; a day in progress is appended as a copy
+        if self.day_obs == 0:
+            return self.daily_col[:self.day_len]
+        return np.concatenate((self.daily_col[:self.day_len], np.array([self.day_summary()], dtype=DAILY_LOG_DTYPE)))
+# End of env_logger
+########################################################
+
+########################################################
+# Snapshot/restore of an episode, for branching rollouts
+########################################################
+# get_env_state(env) captures the battery, the STATE_VARIABLES of env (recovery flag and observations),
+# the harvester cursor and day counter and the log lengths; set_env_state(env, state) brings env back to it.
+# Neither copies the harvester traces or the logs, so a state can be restored any number of times.
+# clone_env(env) is an independent env at the same point of the episode, sharing the traces.
+def get_env_state(env):
+    return (env.env_battery.batt,
+            tuple(getattr(env, name) for name in env.STATE_VARIABLES),
+            env.env_harvester.get_state(),
+            env.logger.get_state())
+
+def set_env_state(env, state):
+    env.env_battery.batt, variables, harvester_state, logger_state = state
+    for name, value in zip(env.STATE_VARIABLES, variables):
+        setattr(env, name, value)
+    env.env_harvester.set_state(harvester_state)
+    env.logger.set_state(logger_state)
+
+def clone_env(env, LOG_DATA=False):
+    # LOG_DATA=False: the clone does not log; otherwise it starts from a copy of the logs
+    clone = copy.copy(env)
+    clone.env_battery = copy.copy(env.env_battery)
+    clone.env_harvester = env.env_harvester.clone()
+    clone.harvester_prefetcher = None # the schedule belongs to env
+    if LOG_DATA:
+        clone.logger = copy.deepcopy(env.logger)
+    else:
+        clone.LOG_DATA = False
+        clone.logger = env_logger(False, 0, env.observation_space.shape[0], len(env.env_timeslot_values))
+    return clone
+########################################################
+
+
+########################################################
+# Mixins shared by the environment templates
+########################################################
+class env_log_views(object): # mixin for the envs that log through an env_logger in self.logger
+    # Logs of the episode, as views of the env_logger columns
+    @property
+    def env_log(self):
+        return self.logger.env_log
+
+    @property
+    def action_log(self):
+        return self.logger.action_log
+
+    @property
+    def eno_log(self):
+        return self.logger.eno_log
+
+    @property
+    def daily_log(self):
+        return self.logger.daily_log
+# End of env_log_views
+########################################################
+class harvester_env(env_log_views): # mixin for the utility_v0/eno_v0 templates
+    # Harvester construction (optionally prefetched in the background) and snapshot/restore of the episode.
+    # The env sets READINGS_PER_DAY, PREDICTOR, harvester_prefetcher, harvester_rng and harvester_noise_bank.
+    def prefetch_harvesters(self, schedule, SEED=None):
+        # opt-in: while an episode runs, build the harvester of the next (location, year) of schedule
+        # in the background so that reset() only swaps it in (see harvester_prefetcher)
+        if self.harvester_prefetcher is not None:
+            self.harvester_prefetcher.close()
+        self.harvester_prefetcher = harvester_prefetcher(schedule, SEED)
+        return self.harvester_prefetcher
+
+    def make_harvester(self, location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON):
+        if self.harvester_prefetcher is None:
+            return self.build_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON, RNG=self.harvester_rng)
+        build = functools.partial(self.build_harvester,
+                                  REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY,
+                                  PREDICTION_HORIZON=PREDICTION_HORIZON)
+        return self.harvester_prefetcher.get(location, year, build)
+
+    def build_harvester(self, location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON, RNG=None):
+        # year can also be a list/range of consecutive years, streamed as one continuous episode
+        if np.ndim(year) == 0:
+            harvester_class = csv_solar_harvester
+        else:
+            harvester_class = csv_solar_harvester_multiyear
+        return harvester_class(location,
+                                year,
+                                READINGS_PER_DAY = self.READINGS_PER_DAY,
+                                SMAX=4.0, # Max GSR
+                                HENERGY_NOISE=0.1, # henergy artifical noise
+                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
+                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
+                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
+                                PENERGY_NOISE=0.005,
+                                NOISE_BANK=self.harvester_noise_bank,
+                                PREDICTOR=self.PREDICTOR,
+                                RNG=RNG)
+
+    # Snapshot/restore of the episode, see get_env_state()
+    def get_state(self):
+        return get_env_state(self)
+
+    def set_state(self, state):
+        set_env_state(self, state)
 
+    def clone(self, LOG_DATA=False):
+        return clone_env(self, LOG_DATA)
+# End of harvester_env
+########################################################
 
 
 
@@ -263,9 +1057,11 @@ class battery(object):
 # HFACTOR = 0.01   
 # DFACTOR = 0.005 
 ########################################################
-class utility_v0_T240(gym.Env):
+class utility_v0_T240(harvester_env, gym.Env):
     """An ambient environment simulator for OpenAI gym."""
     metadata = {'render.modes': ['human']}
+    # episode variables captured by get_state(), besides the battery, harvester and logs
+    STATE_VARIABLES = ('RECOVERY_MODE', 'time_obs', 'henergy_obs', 'penergy_obs', 'benergy_obs', 'utility_obs', 'obs')
     
     def __init__(self):
         super(utility_v0_T240, self).__init__()
@@ -284,6 +1080,10 @@ class utility_v0_T240(gym.Env):
 
         self.HFACTOR = 0.01 
         self.DFACTOR = 0.005 
+        self.PREDICTOR = 'rolling' # energy predictor used by the harvester, see PREDICTORS
+        self.harvester_prefetcher = None # see prefetch_harvesters()
+        self.harvester_rng = None # random generator for the harvester noise (default: np.random)
+        self.harvester_noise_bank = None # trace_noise_bank to take the harvester noise from (instead of harvester_rng)
         
 
     def reset(self, location, year, LOG_DATA=True):
@@ -294,15 +1094,7 @@ class utility_v0_T240(gym.Env):
         PREDICTION_HORIZON=240
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -316,10 +1108,11 @@ class utility_v0_T240(gym.Env):
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -342,8 +1135,7 @@ class utility_v0_T240(gym.Env):
                     self.penergy_obs, 
                     self.benergy_obs,
                     self.utility_obs) #<<<<<<<<
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
     
     def step(self, action):
@@ -384,9 +1176,7 @@ class utility_v0_T240(gym.Env):
     def recovery_action(self):
         assert self.RECOVERY_MODE == True, "Node is not in recovery mode"
         self.env_battery.charge(self.henergy_obs*self.HFACTOR)
-        if self.LOG_DATA:
-            self.eno_log.append(self.henergy_obs*self.HFACTOR)
-            self.action_log.append((-1))
+        self.logger.log_action(-1, self.henergy_obs*self.HFACTOR)
     
     def execute_action(self, action): 
         assert self.RECOVERY_MODE==False, "Node is in recovery mode. Cannot execute action"
@@ -399,9 +1189,7 @@ class utility_v0_T240(gym.Env):
         else:
             self.env_battery.discharge(surplus_energy)
         
-        if self.LOG_DATA:
-            self.eno_log.append(surplus_energy)
-            self.action_log.append((sense_dc))      
+        self.logger.log_action(sense_dc, surplus_energy)
         
 
     def next_obs(self): # update all observations
@@ -423,8 +1211,7 @@ class utility_v0_T240(gym.Env):
                     self.benergy_obs,
                     self.utility_obs) #<<<<<<<<<<<<<
         
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         
         done = HARVESTER_END
 
@@ -478,15 +1265,7 @@ class utility_v0_T120(utility_v0_T240):
         PREDICTION_HORIZON=120 #<<<<<<<<<<
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -500,10 +1279,11 @@ class utility_v0_T120(utility_v0_T240):
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -526,8 +1306,7 @@ class utility_v0_T120(utility_v0_T240):
                     self.penergy_obs, 
                     self.benergy_obs,
                     self.utility_obs) #<<<<<<<<
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
 
 # End of utility_v0_T120
@@ -564,15 +1343,7 @@ class utility_v0_T24(utility_v0_T240):
         PREDICTION_HORIZON=24 #<<<<<<<<<<
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -586,10 +1357,11 @@ class utility_v0_T24(utility_v0_T240):
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -612,8 +1384,7 @@ class utility_v0_T24(utility_v0_T240):
                     self.penergy_obs, 
                     self.benergy_obs,
                     self.utility_obs) #<<<<<<<<
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
 
 # End of utility_v0_T24
@@ -664,15 +1435,7 @@ class utility_v0b_T24_u2(utility_v0b_T24): # changing utility generator
         PREDICTION_HORIZON=24 #<<<<<<<<<<
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -686,10 +1449,11 @@ class utility_v0b_T24_u2(utility_v0b_T24): # changing utility generator
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -712,8 +1476,7 @@ class utility_v0b_T24_u2(utility_v0b_T24): # changing utility generator
                     self.penergy_obs, 
                     self.benergy_obs,
                     self.utility_obs) #<<<<<<<<
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
 
 # End of utility_v0b_T24_u2
@@ -729,15 +1492,7 @@ class utility_v2_T24(utility_v0_T24): # using night_utility_generator_v2
         PREDICTION_HORIZON=24 #<<<<<<<<<<
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -751,10 +1506,11 @@ class utility_v2_T24(utility_v0_T24): # using night_utility_generator_v2
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -777,8 +1533,7 @@ class utility_v2_T24(utility_v0_T24): # using night_utility_generator_v2
                     self.penergy_obs, 
                     self.benergy_obs,
                     self.utility_obs) #<<<<<<<<
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
 
 # End of utility_v2_T24
@@ -818,15 +1573,7 @@ class utility_v3_T24(utility_v0_T24): # using night_utility_generator_v2
         PREDICTION_HORIZON=24 #<<<<<<<<<<
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -840,10 +1587,11 @@ class utility_v3_T24(utility_v0_T24): # using night_utility_generator_v2
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -866,8 +1614,7 @@ class utility_v3_T24(utility_v0_T24): # using night_utility_generator_v2
                     self.penergy_obs, 
                     self.benergy_obs,
                     self.utility_obs) #<<<<<<<<
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
 
 # End of utility_v2_T24
@@ -903,9 +1650,11 @@ class utility_v3b_T24(utility_v3_T24):
 ########################################################
 # eno_v0: environment template
 ########################################################
-class eno_v0(gym.Env):
+class eno_v0(harvester_env, gym.Env):
     """An ambient environment simulator for OpenAI gym."""
     metadata = {'render.modes': ['human']}
+    # episode variables captured by get_state(), besides the battery, harvester and logs
+    STATE_VARIABLES = ('RECOVERY_MODE', 'time_obs', 'henergy_obs', 'penergy_obs', 'benergy_obs', 'obs')
     
     def __init__(self):
         super(eno_v0, self).__init__()
@@ -924,6 +1673,14 @@ class eno_v0(gym.Env):
 
         self.HFACTOR = 0.02 
         self.DFACTOR = 0.01 
+        self.PREDICTOR = 'rolling' # energy predictor used by the harvester, see PREDICTORS
+        self.harvester_prefetcher = None # see prefetch_harvesters()
+        self.harvester_rng = None # random generator for the harvester noise (default: np.random)
+        self.harvester_noise_bank = None # trace_noise_bank to take the harvester noise from (instead of harvester_rng)
+        self.FAST_STEP = False # step with plain-float battery math, see fast_step()
+        self.NIGHT_STEP = False # collapse zero-harvest stretches into one macro-step, see night_step()
+        self.GAMMA = 1.0 # discount of the rewards aggregated by a macro-step
+        self.HOLDS = None # hold lengths the agent can choose from, see set_action_holds()
         
 
     def reset(self, location, year, LOG_DATA=True):
@@ -934,15 +1691,7 @@ class eno_v0(gym.Env):
         PREDICTION_HORIZON=240
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -956,10 +1705,11 @@ class eno_v0(gym.Env):
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -979,11 +1729,56 @@ class eno_v0(gym.Env):
                     self.henergy_obs, 
                     self.penergy_obs, 
                     self.benergy_obs)
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
     
+    def set_action_holds(self, HOLDS=None):
+        # Action repeat: with HOLDS, e.g. (1, 4, 16), an action picks a duty cycle and a hold length,
+        #     action = hold_index*NO_OF_DUTY_CYCLES + duty cycle action
+        # and step() holds the duty cycle for HOLDS[hold_index] timeslots (see hold_step()).
+        # HOLDS=None restores one timeslot per action.
+        self.HOLDS = None if HOLDS is None else tuple(HOLDS)
+        NO_OF_HOLDS = 1 if HOLDS is None else len(self.HOLDS)
+        self.action_space = spaces.Discrete(n=self.NO_OF_DUTY_CYCLES*NO_OF_HOLDS)
+        return self.action_space
+
     def step(self, action):
+        if self.HOLDS is not None:
+            return self.hold_step(action)
+        if self.NIGHT_STEP:
+            return self.night_step(action)
+        return self.timeslot_step(action)
+
+    def hold_step(self, action):
+        # Holds the duty cycle of action for its hold length, one timeslot_step() per timeslot, so that
+        # recovery mode (entered or left mid-hold) and day boundaries are handled as in single steps;
+        # the duty cycle applies again once the node is out of recovery mode. The hold stops early at
+        # the end of the trace. Returns (obs, reward, done, info) like step(), where
+        #     reward           : sum of the rewards of the timeslots, the k-th one discounted by GAMMA**k
+        #     info['duration'] : number of timeslots advanced (discount the next value by GAMMA**duration)
+        # In recovery mode the action is ignored (e.g. step(-1)) and one timeslot is taken, as by step().
+        if self.RECOVERY_MODE or self.benergy_obs < self.MIN_BATT:
+            next_obs, reward, done, info = self.timeslot_step(action)
+            info['duration'] = 1
+            return next_obs, reward, done, info
+        assert 0<=action<self.action_space.n, "Invalid Action"
+        hold = self.HOLDS[action // self.NO_OF_DUTY_CYCLES]
+        action = action % self.NO_OF_DUTY_CYCLES
+
+        reward = 0.0
+        discount = 1.0
+        for duration in range(1, hold+1):
+            next_obs, step_reward, done, info = self.timeslot_step(action)
+            reward += discount*step_reward
+            discount *= self.GAMMA
+            if done:
+                break
+        info['duration'] = duration
+        return next_obs, reward, done, info
+
+    def timeslot_step(self, action): # advance by one timeslot
+        if self.FAST_STEP:
+            return self.fast_step(action)
         if self.benergy_obs < self.MIN_BATT: # Is battery less than a threshold?
             self.RECOVERY_MODE = True
         
@@ -1005,6 +1800,37 @@ class eno_v0(gym.Env):
         return np.array(next_obs), reward, done, info
     
     
+    def fast_step(self, action):
+        # Same transitions as step() (verify_action, execute_action/recovery_action, reward, next_obs)
+        # with the battery updated in plain Python floats: no np.clip on scalars and no asserts.
+        # min(max(batt,0),1) rounds exactly like np.clip, so trajectories are bit-identical.
+        if self.benergy_obs < self.MIN_BATT: # Is battery less than a threshold?
+            self.RECOVERY_MODE = True
+        
+        env_battery = self.env_battery
+        if not self.RECOVERY_MODE:
+            sense_dc = action/self.NO_OF_DUTY_CYCLES + self.MIN_DC
+            surplus_energy = (self.henergy_obs*self.HFACTOR - (sense_dc)*self.DFACTOR)
+            if (-surplus_energy) < self.benergy_obs: # valid action
+                if surplus_energy > 0:
+                    batt = env_battery.batt + surplus_energy*env_battery.BEFF # charge
+                else:
+                    batt = env_battery.batt + surplus_energy # discharge
+                env_battery.batt = min(max(batt,0.0),1.0)
+                self.logger.log_action(sense_dc, surplus_energy)
+            else:
+                self.RECOVERY_MODE = True # switch to recovery mode
+        if self.RECOVERY_MODE:
+            harvested_energy = self.henergy_obs*self.HFACTOR
+            env_battery.batt = min(max(env_battery.batt + harvested_energy*env_battery.BEFF,0.0),1.0) # charge
+            self.logger.log_action(-1, harvested_energy)
+        reward = self.reward(action)
+        
+        next_obs, done = self.next_obs()
+        info = {}
+        
+        return np.array(next_obs), reward, done, info
+
     def verify_action(self, action): # check if actions are valid
         assert self.RECOVERY_MODE == False, "Action does not need to be verified in recovery mode"
         assert 0<=action<self.NO_OF_DUTY_CYCLES, "Invalid Action"
@@ -1021,9 +1847,7 @@ class eno_v0(gym.Env):
     def recovery_action(self):
         assert self.RECOVERY_MODE == True, "Node is not in recovery mode"
         self.env_battery.charge(self.henergy_obs*self.HFACTOR)
-        if self.LOG_DATA:
-            self.eno_log.append(self.henergy_obs*self.HFACTOR)
-            self.action_log.append((-1))
+        self.logger.log_action(-1, self.henergy_obs*self.HFACTOR)
     
     def execute_action(self, action): 
         assert self.RECOVERY_MODE==False, "Node is in recovery mode. Cannot execute action"
@@ -1036,9 +1860,7 @@ class eno_v0(gym.Env):
         else:
             self.env_battery.discharge(surplus_energy)
         
-        if self.LOG_DATA:
-            self.eno_log.append(surplus_energy)
-            self.action_log.append((sense_dc))      
+        self.logger.log_action(sense_dc, surplus_energy)
         
 
     def next_obs(self): # update all observations
@@ -1046,7 +1868,10 @@ class eno_v0(gym.Env):
         self.time_obs, self.henergy_obs, self.penergy_obs, DAY_END, HARVESTER_END = self.env_harvester.step()
 
         if not HARVESTER_END:
-            self.benergy_obs = self.env_battery.get_batt_state() # updated battery observation
+            if self.FAST_STEP:
+                self.benergy_obs = self.env_battery.batt # fast_step() keeps batt within [0,1]
+            else:
+                self.benergy_obs = self.env_battery.get_batt_state() # updated battery observation
             if self.RECOVERY_MODE:
                 if self.benergy_obs > self.BINIT: 
                     self.RECOVERY_MODE = False # snap out of recovery mode
@@ -1058,18 +1883,146 @@ class eno_v0(gym.Env):
                     self.penergy_obs, 
                     self.benergy_obs)
         
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
-        
+        self.logger.log_obs(self.obs, DAY_END)
+
         done = HARVESTER_END
 
         return self.obs, done
-    
+
+    def fast_forward_recovery(self, GAMMA=1.0):
+        # Advances through the whole recovery period in one call: the battery, observations, logs and
+        # harvester end up exactly as after calling step() until the node snaps out of recovery mode
+        # (or the trace ends). Returns (obs, reward, done, info) like step(), where
+        #     reward           : sum of the rewards of the skipped steps, the k-th one discounted by GAMMA**k
+        #     info['duration'] : number of timeslots advanced (0 if the node is not in recovery mode)
+        # In recovery the battery only charges (henergy*HFACTOR*BEFF per timeslot) and stays at or below
+        # BINIT < 1 until the exit timeslot, so its trajectory is a cumulative sum of the harvest trace
+        # (np.cumsum adds sequentially, like step()) that only needs clipping on the last timeslot.
+        if self.benergy_obs < self.MIN_BATT: # Is battery less than a threshold?
+            self.RECOVERY_MODE = True
+
+        reward = 0.0
+        discount = 1.0
+        duration = 0
+        done = False
+        while self.RECOVERY_MODE and not done:
+            step_reward = self.reward(-1) # every step in recovery mode gets the recovery reward
+            time, henergy, penergy, DAY_END, HARVESTER_END = self.env_harvester.get_block(len(self.env_timeslot_values))
+            if len(time) == 0: # year boundary of a multi-year harvester: take one regular step
+                _, step_reward, done, _ = self.timeslot_step(0)
+                reward += discount*step_reward
+                discount *= GAMMA
+                duration += 1
+                continue
+
+            # battery after each step of the block
+            harvested_energy = np.concatenate(([self.henergy_obs], henergy[:-1]))*self.HFACTOR
+            batt = np.cumsum(np.concatenate(([self.env_battery.batt], harvested_energy*self.env_battery.BEFF)))[1:]
+            stop = np.flatnonzero((batt > self.BINIT) | HARVESTER_END) # exit or end of the trace
+            length = stop[0] + 1 if len(stop) else len(time)
+            batt = batt[:length]
+            batt[-1] = min(batt[-1], 1.0)
+            done = bool(HARVESTER_END[length-1])
+
+            # battery observations: not updated on the last timeslot of the trace
+            benergy = batt.copy()
+            if done:
+                benergy[-1] = benergy[-2] if length > 1 else self.benergy_obs
+            elif batt[-1] > self.BINIT:
+                self.RECOVERY_MODE = False # snap out of recovery mode
+
+            self.env_battery.batt = batt[-1]
+            self.env_harvester.skip(length)
+            self.time_obs = float(time[length-1])
+            self.henergy_obs = float(henergy[length-1])
+            self.penergy_obs = float(penergy[length-1])
+            self.benergy_obs = float(benergy[-1])
+            self.obs = (self.time_obs/self.READINGS_PER_DAY,
+                        self.henergy_obs,
+                        self.penergy_obs,
+                        self.benergy_obs)
+            self.log_block(np.full(length, -1.0),
+                           harvested_energy[:length],
+                           np.column_stack((time[:length]/self.READINGS_PER_DAY, henergy[:length], penergy[:length], benergy)),
+                           DAY_END[:length])
+
+            reward += discount*step_reward*np.sum(GAMMA**np.arange(length))
+            discount *= GAMMA**length
+            duration += length
+
+        info = {'duration': duration}
+        return np.array(self.obs), reward, done, info
+
+    # rewards (see reward_lib) that only depend on the observation of the step, so that
+    # night_step() can compute them for a whole macro-step at once
+    MACRO_STEP_REWARDS = ('eno_v0', 'eno_v0_g99', 'eno_v0_g999', 'eno_v0_g999a')
+
+    def night_step(self, action):
+        # Event-driven step over zero-harvest timeslots (SMDP style). Without harvest, each step
+        # drains the battery by sense_dc*DFACTOR, so when the current timeslot has henergy == 0 the
+        # action is held over the whole zero-harvest stretch ahead in one macro-step. The macro-step
+        # ends on the first observation with harvest, before a step that would go into recovery
+        # mode, or at the end of the trace. Returns (obs, reward, done, info) like step(), where
+        #     reward           : sum of the rewards of the steps, the k-th one discounted by GAMMA**k
+        #     info['duration'] : number of timeslots advanced (discount the next value by GAMMA**duration)
+        # Otherwise (harvest, recovery mode, or a reward not in MACRO_STEP_REWARDS) it takes a single step.
+        # Battery, observations and logs end up exactly as after the same number of step(action).
+        MACRO_STEP = (self.henergy_obs == 0 and not self.RECOVERY_MODE and
+                      reward_lib.reward_class(type(self)).__name__ in self.MACRO_STEP_REWARDS)
+        if MACRO_STEP:
+            time, henergy, penergy, DAY_END, HARVESTER_END = self.env_harvester.get_block(len(self.env_timeslot_values))
+            assert 0<=action<self.NO_OF_DUTY_CYCLES, "Invalid Action"
+            sense_dc = action/self.NO_OF_DUTY_CYCLES + self.MIN_DC
+            surplus_energy = (self.henergy_obs*self.HFACTOR - (sense_dc)*self.DFACTOR)
+
+            # battery before each step (np.cumsum adds sequentially, like step()); a valid step never clips
+            batt = np.cumsum(np.concatenate(([self.env_battery.batt], np.full(len(time), surplus_energy))))
+            VALID = (batt[:-1] >= self.MIN_BATT) & ((-surplus_energy) < batt[:-1])
+            stop = np.flatnonzero(~VALID)
+            length = stop[0] if len(stop) else len(time) # steps before recovery mode
+            stop = np.flatnonzero((henergy > 0) | HARVESTER_END)
+            if len(stop):
+                length = min(length, stop[0] + 1) # steps up to the first harvest or the end of the trace
+            MACRO_STEP = length > 0
+        if not MACRO_STEP:
+            next_obs, reward, done, info = self.timeslot_step(action)
+            info['duration'] = 1
+            return next_obs, reward, done, info
+
+        done = bool(HARVESTER_END[length-1])
+        benergy = batt[1:length+1].copy()
+        if done:
+            benergy[-1] = batt[length-1] # the battery observation is not updated on the last timeslot of the trace
+        obs = np.column_stack((time[:length]/self.READINGS_PER_DAY, henergy[:length], penergy[:length], benergy))
+        step_obs = np.concatenate((np.array([self.obs]), obs[:-1]))
+        NO_RECOVERY = np.zeros(length, dtype=bool)
+        trajectory = reward_lib.Trajectory(step_obs, np.full(length, sense_dc), NO_RECOVERY, obs, NO_RECOVERY)
+        step_reward = reward_lib.relabel(trajectory, self)
+
+        self.env_battery.batt = batt[length]
+        self.env_harvester.skip(length)
+        self.time_obs = float(time[length-1])
+        self.henergy_obs = float(henergy[length-1])
+        self.penergy_obs = float(penergy[length-1])
+        self.benergy_obs = float(benergy[-1])
+        self.obs = (self.time_obs/self.READINGS_PER_DAY,
+                    self.henergy_obs,
+                    self.penergy_obs,
+                    self.benergy_obs)
+        self.log_block(np.full(length, sense_dc), np.full(length, surplus_energy), obs, DAY_END[:length])
+
+        reward = np.dot(self.GAMMA**np.arange(length), step_reward)
+        info = {'duration': length}
+        return np.array(self.obs), reward, done, info
+
+    def log_block(self, action, eno, obs, DAY_END): # logs of consecutive steps taken at once
+        self.logger.log_block(action, eno, obs, DAY_END)
+
     def reward(self,action): # symmetric linear reward
         if self.RECOVERY_MODE:
             return -1 # penalize recovery mode
         else:
-            return (0.5 - np.abs(self.benergy_obs - 0.5))*4 - 1
+            return (0.5 - abs(self.benergy_obs - 0.5))*4 - 1
     # End of eno_v0
 ########################################################
 ########################################################
@@ -1089,7 +2042,7 @@ class eno_v0_g99(eno_v0): # for gamma=0.99
         if self.RECOVERY_MODE:
             return -1 # penalize recovery mode
         else:
-            return ((0.5 - np.abs(self.benergy_obs - 0.5))*4 - 1)*0.1
+            return ((0.5 - abs(self.benergy_obs - 0.5))*4 - 1)*0.1
 # End of eno_v0_g99
 ########################################################
 ########################################################
@@ -1098,7 +2051,7 @@ class eno_v0_g999(eno_v0): # for gamma=0.99
         if self.RECOVERY_MODE:
             return -1 # penalize recovery mode
         else:
-            return ((0.5 - np.abs(self.benergy_obs - 0.5))*4 - 1)*0.01
+            return ((0.5 - abs(self.benergy_obs - 0.5))*4 - 1)*0.01
 # End of eno_v0_g999
 ########################################################
 ########################################################
@@ -1107,7 +2060,7 @@ class eno_v0_g999a(eno_v0): # for gamma=0.99
         if self.RECOVERY_MODE:
             return -1 # penalize recovery mode
         else:
-            return ((0.5 - np.abs(self.benergy_obs - 0.5))*4 - 1)*0.1
+            return ((0.5 - abs(self.benergy_obs - 0.5))*4 - 1)*0.1
 # End of eno_v0_g999a
 
 class eno_v0a(eno_v0): #changed HFACTOR and DFACTOR
@@ -1204,15 +2157,7 @@ class eno_v0_T24(eno_v0): # 24 timesteps in one day
         PREDICTION_HORIZON=24 #<<<<<<<
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -1226,10 +2171,11 @@ class eno_v0_T24(eno_v0): # 24 timesteps in one day
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -1249,8 +2195,7 @@ class eno_v0_T24(eno_v0): # 24 timesteps in one day
                     self.henergy_obs, 
                     self.penergy_obs, 
                     self.benergy_obs)
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
 # End of eno_v0_T24
 ########################################################
@@ -1284,15 +2229,7 @@ class eno_v0_T48(eno_v0): # 48 timesteps in one day
         PREDICTION_HORIZON=48 #<<<<<<<
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -1306,10 +2243,11 @@ class eno_v0_T48(eno_v0): # 48 timesteps in one day
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -1329,8 +2267,7 @@ class eno_v0_T48(eno_v0): # 48 timesteps in one day
                     self.henergy_obs, 
                     self.penergy_obs, 
                     self.benergy_obs)
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
 # End of eno_v0_T48
 ########################################################
@@ -1351,15 +2288,7 @@ class eno_v0_T120(eno_v0): # 120 timesteps in one day
         PREDICTION_HORIZON=120 #<<<<<<<
         
 
-        self.env_harvester = csv_solar_harvester(location=location,
-                                year=year,
-                                READINGS_PER_DAY = self.READINGS_PER_DAY,
-                                SMAX=4.0, # Max GSR
-                                HENERGY_NOISE=0.1, # henergy artifical noise
-                                NORMALIZED_HMIN_THRES=1E-5, # henergy cutoff
-                                REQ_TIMESLOTS_PER_DAY=REQ_TIMESLOTS_PER_DAY, # no. of timeslots per day
-                                PREDICTION_HORIZON=PREDICTION_HORIZON, # lookahead horizon to predict energy
-                                PENERGY_NOISE=0.005)
+        self.env_harvester = self.make_harvester(location, year, REQ_TIMESLOTS_PER_DAY, PREDICTION_HORIZON)
         self.env_timeslot_values = self.env_harvester.time_slots
         self.ENV_LIFETIME = self.env_harvester.no_of_days
         
@@ -1373,10 +2302,11 @@ class eno_v0_T120(eno_v0): # 120 timesteps in one day
         # Characterize channel fading
         
         # Data logging variables
-        self.LOG_DATA = LOG_DATA # Flag to whether or not log data
-        self.env_log = [] # record all values in the environment
-        self.action_log = [] # record all actions sent to the environment
-        self.eno_log = []
+        self.LOG_DATA = LOG_DATA # Flag to whether or not log data: True/'full', 'daily' or False/'off'
+        self.logger = env_logger(LOG_DATA, # record all values, actions and eno of the environment
+                                 self.ENV_LIFETIME*len(self.env_timeslot_values),
+                                 self.observation_space.shape[0],
+                                 len(self.env_timeslot_values))
         
         # Observation variables
         self.time_obs = None
@@ -1396,8 +2326,7 @@ class eno_v0_T120(eno_v0): # 120 timesteps in one day
                     self.henergy_obs, 
                     self.penergy_obs, 
                     self.benergy_obs)
-        if self.LOG_DATA:
-            self.env_log.append(self.obs)
+        self.logger.log_obs(self.obs, DAY_END)
         return np.array(self.obs)
 # End of eno_v0_T120
 ########################################################
@@ -1413,19 +2342,77 @@ class eno_v0_T120(eno_v0): # 120 timesteps in one day
 #
 ########################################################
 ########################################################
-class sparse_v0_T24_4x(eno_v0_T24): # 4 rewards per day,24 timesteps per day
+class sparse_day_window(object): # mixin for the sparse reward environments
+    # Sparse reward at the REWARD_QUARTERS of the day (4 = last timeslot of the day):
+    # +1 if the mean battery observation of the last day (the previous TIMESLOTS_PER_DAY-1 observations)
+    # lies within (2*MIN_BATT, 1-2*MIN_BATT), -1 otherwise; 0 at the other timeslots; -1 in recovery mode.
+    # The battery observations of the last day are kept in a ring buffer filled by reset()/next_obs()
+    # whatever LOG_DATA is, and the reward timeslots are a precomputed mask over the timeslots of a day.
+    # A step is O(1); the mean over the day is only taken at the reward timeslots.
+    REWARD_QUARTERS = (4,)
+
+    def reset(self, location, year, LOG_DATA=True):
+        obs = super(sparse_day_window, self).reset(location, year, LOG_DATA)
+        TIMESLOTS_PER_DAY = len(self.env_timeslot_values)
+        self.reward_timeslots = np.zeros(TIMESLOTS_PER_DAY, dtype=bool)
+        for quarter in self.REWARD_QUARTERS:
+            if quarter == 4:
+                self.reward_timeslots[-1] = True # end of day
+            else:
+                self.reward_timeslots[int(quarter*TIMESLOTS_PER_DAY/4)] = True
+        self.day_batt = np.zeros(TIMESLOTS_PER_DAY) # ring buffer of the last day of battery observations
+        self.day_batt_len = 0 # number of battery observations recorded so far
+        self.record_day_batt()
+        return obs
+
+    def next_obs(self):
+        obs, done = super(sparse_day_window, self).next_obs()
+        self.record_day_batt()
+        return obs, done
+
+    def log_block(self, action, eno, obs, DAY_END):
+        super(sparse_day_window, self).log_block(action, eno, obs, DAY_END)
+        benergy = obs[-len(self.day_batt):,3] # older observations are overwritten anyway
+        ring_index = (self.day_batt_len + len(obs) - len(benergy) + np.arange(len(benergy))) % len(self.day_batt)
+        self.day_batt[ring_index] = benergy
+        self.day_batt_len += len(obs)
+
+    def get_state(self):
+        state = super(sparse_day_window, self).get_state()
+        return state + (self.day_batt.copy(), self.day_batt_len)
+
+    def set_state(self, state):
+        super(sparse_day_window, self).set_state(state[:-2])
+        self.day_batt[:] = state[-2]
+        self.day_batt_len = state[-1]
+
+    def clone(self, LOG_DATA=False):
+        clone = super(sparse_day_window, self).clone(LOG_DATA)
+        clone.day_batt = self.day_batt.copy()
+        return clone
+
+    def record_day_batt(self):
+        self.day_batt[self.day_batt_len % len(self.day_batt)] = self.benergy_obs
+        self.day_batt_len += 1
+
+    def mean_day_batt(self):
+        # mean of the battery observations of the last day, excluding the current one
+        TIMESLOTS_PER_DAY = len(self.day_batt)
+        window = min(self.day_batt_len, TIMESLOTS_PER_DAY) - 1
+        end = (self.day_batt_len - 1) % TIMESLOTS_PER_DAY # ring index of the current observation
+        start = end - window
+        if start >= 0:
+            day_batt = self.day_batt[start:end]
+        else:
+            day_batt = np.concatenate((self.day_batt[start:], self.day_batt[:end]))
+        return np.mean(day_batt)
+
     def reward(self,action): # sparse rewards at particular time intervals
-        end_time = self.env_timeslot_values[-1]
-        half_time = self.env_timeslot_values[int(2*len(self.env_timeslot_values)/4)]
-        q1_time = self.env_timeslot_values[int(len(self.env_timeslot_values)/4)]
-        q3_time = self.env_timeslot_values[int(3*len(self.env_timeslot_values)/4)]
-        interval_set = set((q1_time, half_time, q3_time, end_time))
         if self.RECOVERY_MODE:
             return -1 # penalize recovery mode
         
-        if self.time_obs in interval_set:
-            batt_log = [obs[3] for obs in self.env_log]
-            mean_day_batt = np.mean(batt_log[-len(self.env_timeslot_values):-1])
+        if self.reward_timeslots[self.env_harvester.global_time % len(self.reward_timeslots)]:
+            mean_day_batt = self.mean_day_batt()
             lowthreshold = 2*self.MIN_BATT
             if lowthreshold<mean_day_batt<(1-lowthreshold):
                 return 1
@@ -1433,159 +2420,46 @@ class sparse_v0_T24_4x(eno_v0_T24): # 4 rewards per day,24 timesteps per day
                 return -1
         else:
             return 0
+# End of sparse_day_window
+########################################################
+########################################################
+class sparse_v0_T24_4x(sparse_day_window, eno_v0_T24): # 4 rewards per day,24 timesteps per day
+    REWARD_QUARTERS = (1,2,3,4) # quarters of the day with a reward (4 = last timeslot)
 # End of sparse_v0_T24_4x
 ########################################################
 ########################################################
-class sparse_v0_T24_2x(eno_v0_T24): # 2 rewards per day, 24 timesteps per day
-    def reward(self,action): # sparse rewards at particular time intervals
-        end_time = self.env_timeslot_values[-1]
-        half_time = self.env_timeslot_values[int(2*len(self.env_timeslot_values)/4)]
-        q1_time = self.env_timeslot_values[int(len(self.env_timeslot_values)/4)]
-        q3_time = self.env_timeslot_values[int(3*len(self.env_timeslot_values)/4)]
-        interval_set = set((half_time, end_time))
-        if self.RECOVERY_MODE:
-            return -1 # penalize recovery mode
-        
-        if self.time_obs in interval_set:
-            batt_log = [obs[3] for obs in self.env_log]
-            mean_day_batt = np.mean(batt_log[-len(self.env_timeslot_values):-1])
-            lowthreshold = 2*self.MIN_BATT
-            if lowthreshold<mean_day_batt<(1-lowthreshold):
-                return 1
-            else:
-                return -1
-        else:
-            return 0
+class sparse_v0_T24_2x(sparse_day_window, eno_v0_T24): # 2 rewards per day, 24 timesteps per day
+    REWARD_QUARTERS = (2,4) # quarters of the day with a reward (4 = last timeslot)
 # End of sparse_v0_T24_2x
 ########################################################
 ########################################################
-class sparse_v0_T24_1x(eno_v0_T24): # 1 reward per day, 24 timesteps per day
-    def reward(self,action): # sparse rewards at particular time intervals
-        end_time = self.env_timeslot_values[-1]
-        if self.RECOVERY_MODE:
-            return -1 # penalize recovery mode
-        
-        if self.time_obs == end_time:
-            batt_log = [obs[3] for obs in self.env_log]
-            mean_day_batt = np.mean(batt_log[-len(self.env_timeslot_values):-1])
-            lowthreshold = 2*self.MIN_BATT
-            if lowthreshold<mean_day_batt<(1-lowthreshold):
-                return 1
-            else:
-                return -1
-        else:
-            return 0
+class sparse_v0_T24_1x(sparse_day_window, eno_v0_T24): # 1 reward per day, 24 timesteps per day
+    REWARD_QUARTERS = (4,) # quarters of the day with a reward (4 = last timeslot)
 # End of sparse_v0_T24_1x
 ########################################################
 ########################################################
-class sparse_v0_T120_1x(eno_v0_T120): # 1 reward per day, 120 timesteps per day
-    def reward(self,action): # sparse rewards at particular time intervals
-        end_time = self.env_timeslot_values[-1]
-        if self.RECOVERY_MODE:
-            return -1 # penalize recovery mode
-        
-        if self.time_obs == end_time:
-            batt_log = [obs[3] for obs in self.env_log]
-            mean_day_batt = np.mean(batt_log[-len(self.env_timeslot_values):-1])
-            lowthreshold = 2*self.MIN_BATT
-            if lowthreshold<mean_day_batt<(1-lowthreshold):
-                return 1
-            else:
-                return -1
-        else:
-            return 0
+class sparse_v0_T120_1x(sparse_day_window, eno_v0_T120): # 1 reward per day, 120 timesteps per day
+    REWARD_QUARTERS = (4,) # quarters of the day with a reward (4 = last timeslot)
 # End of sparse_v0_T120_1x
 ########################################################
 ########################################################
-class sparse_v0_T120_4x(eno_v0_T120): # 4 rewards per day, 120 timesteps per day
-    def reward(self,action): # sparse rewards at particular time intervals
-        end_time = self.env_timeslot_values[-1]
-        half_time = self.env_timeslot_values[int(2*len(self.env_timeslot_values)/4)]
-        q1_time = self.env_timeslot_values[int(len(self.env_timeslot_values)/4)]
-        q3_time = self.env_timeslot_values[int(3*len(self.env_timeslot_values)/4)]
-        interval_set = set((q1_time, half_time, q3_time, end_time))
-        if self.RECOVERY_MODE:
-            return -1 # penalize recovery mode
-        
-        if self.time_obs in interval_set:
-            batt_log = [obs[3] for obs in self.env_log]
-            mean_day_batt = np.mean(batt_log[-len(self.env_timeslot_values):-1])
-            lowthreshold = 2*self.MIN_BATT
-            if lowthreshold<mean_day_batt<(1-lowthreshold):
-                return 1
-            else:
-                return -1
-        else:
-            return 0
+class sparse_v0_T120_4x(sparse_day_window, eno_v0_T120): # 4 rewards per day, 120 timesteps per day
+    REWARD_QUARTERS = (1,2,3,4) # quarters of the day with a reward (4 = last timeslot)
 # End of sparse_v0_T120_4x
 ########################################################
 ########################################################
-class sparse_v0_1x(eno_v0): # 1 reward per day,240 timesteps per day
-    def reward(self,action): # sparse rewards at particular time intervals
-        end_time = self.env_timeslot_values[-1]
-        half_time = self.env_timeslot_values[int(2*len(self.env_timeslot_values)/4)]
-        q1_time = self.env_timeslot_values[int(len(self.env_timeslot_values)/4)]
-        q3_time = self.env_timeslot_values[int(3*len(self.env_timeslot_values)/4)]
-        interval_set = set((end_time))
-        if self.RECOVERY_MODE:
-            return -1 # penalize recovery mode
-        
-        if self.time_obs in interval_set:
-            batt_log = [obs[3] for obs in self.env_log]
-            mean_day_batt = np.mean(batt_log[-len(self.env_timeslot_values):-1])
-            lowthreshold = 2*self.MIN_BATT
-            if lowthreshold<mean_day_batt<(1-lowthreshold):
-                return 1
-            else:
-                return -1
-        else:
-            return 0
+class sparse_v0_1x(sparse_day_window, eno_v0): # 1 reward per day,240 timesteps per day
+    REWARD_QUARTERS = (4,) # quarters of the day with a reward (4 = last timeslot)
 # End of sparse_v0_1x
 ########################################################
 ########################################################
-class sparse_v0_2x(eno_v0):  # 2 rewards per day,240 timesteps per day
-    def reward(self,action): # sparse rewards at particular time intervals
-        end_time = self.env_timeslot_values[-1]
-        half_time = self.env_timeslot_values[int(2*len(self.env_timeslot_values)/4)]
-        q1_time = self.env_timeslot_values[int(len(self.env_timeslot_values)/4)]
-        q3_time = self.env_timeslot_values[int(3*len(self.env_timeslot_values)/4)]
-        interval_set = set((half_time, end_time))
-        if self.RECOVERY_MODE:
-            return -1 # penalize recovery mode
-        
-        if self.time_obs in interval_set:
-            batt_log = [obs[3] for obs in self.env_log]
-            mean_day_batt = np.mean(batt_log[-len(self.env_timeslot_values):-1])
-            lowthreshold = 2*self.MIN_BATT
-            if lowthreshold<mean_day_batt<(1-lowthreshold):
-                return 1
-            else:
-                return -1
-        else:
-            return 0
+class sparse_v0_2x(sparse_day_window, eno_v0):  # 2 rewards per day,240 timesteps per day
+    REWARD_QUARTERS = (2,4) # quarters of the day with a reward (4 = last timeslot)
 # End of sparse_v0_2x
 ########################################################
 ########################################################
-class sparse_v0_4x(eno_v0):  # 3 rewards per day,240 timesteps per day
-    def reward(self,action): # sparse rewards at particular time intervals
-        end_time = self.env_timeslot_values[-1]
-        half_time = self.env_timeslot_values[int(2*len(self.env_timeslot_values)/4)]
-        q1_time = self.env_timeslot_values[int(len(self.env_timeslot_values)/4)]
-        q3_time = self.env_timeslot_values[int(3*len(self.env_timeslot_values)/4)]
-        interval_set = set((q1_time, half_time, q3_time, end_time))
-        if self.RECOVERY_MODE:
-            return -1 # penalize recovery mode
-        
-        if self.time_obs in interval_set:
-            batt_log = [obs[3] for obs in self.env_log]
-            mean_day_batt = np.mean(batt_log[-len(self.env_timeslot_values):-1])
-            lowthreshold = 2*self.MIN_BATT
-            if lowthreshold<mean_day_batt<(1-lowthreshold):
-                return 1
-            else:
-                return -1
-        else:
-            return 0
+class sparse_v0_4x(sparse_day_window, eno_v0):  # 3 rewards per day,240 timesteps per day
+    REWARD_QUARTERS = (1,2,3,4) # quarters of the day with a reward (4 = last timeslot)
 # End of sparse_v0_4x
 ########################################################
 ########################################################
\ No newline at end of file
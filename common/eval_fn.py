@@ -0,0 +1,79 @@
+########################################################
+# Batched policy evaluation over many (location, year) traces
+########################################################
+import numpy as np
+import pandas as pd
+import gym
+
+from common import env_lib, wrappers
+from common.vec_env_lib import VecEnoEnv
+
+########################################################
+# Observation wrappers applied to a batch of observations (node x obs)
+########################################################
+def wrapped_obs_fn(env):
+    # batch version of the observation wrappers around env, e.g. wrapped_obs_fn(wrap_all(env))
+    # reward wrappers are ignored: the evaluation reports the reward of the base env
+    wrapper_classes = []
+    while isinstance(env, gym.Wrapper):
+        if isinstance(env, gym.ObservationWrapper):
+            assert hasattr(env, 'obs_transform'), 'No batch version of ' + type(env).__name__
+            wrapper_classes.insert(0, type(env)) # the innermost wrapper is applied first
+        env = env.env
+    return wrappers.obs_pipeline(wrapper_classes, env.observation_space.shape[0])
+
+########################################################
+# Policies: batch of observations >> batch of actions
+########################################################
+def greedy_policy(net, device="cpu"):
+    # argmax of the Q-values of a DQN/DuelingDQN, one forward pass for the whole batch
+    # torch is only needed here, so that the rule-based and oracle baselines can be evaluated without it
+    import torch
+    def policy(obs):
+        with torch.no_grad():
+            q_vals_v = net(torch.tensor(obs).to(device))
+        return q_vals_v.argmax(dim=1).cpu().numpy()
+    return policy
+
+########################################################
+# Evaluation
+########################################################
+def evaluation_traces(solar_dir=None):
+    # every (location, year) under solar_data/ with a numeric year
+    return [(location, year) for location, year in env_lib.list_solar_traces(solar_dir)
+            if isinstance(year, int)]
+
+def evaluate_policy(policy, ENV_NAME='eno_v0', traces=None, obs_fn=None, SEEDS=None):
+    # Runs policy on every trace at once (default: all of solar_data/) and returns one row per run:
+    #     AVG REWARD      : avg_reward    = mean reward per step
+    #     ENERGY PERF     : eno_perf      = eno_log.cumsum()[-1]
+    #     RECOVERY(DAYS)  : recovery_days = timeslots in recovery mode after a step / timeslots per day
+    # as printed by the "Enjoy trained agent" cells of the notebooks.
+    # obs_fn maps the env observations to the policy input (see wrapped_obs_fn).
+    if traces is None:
+        traces = evaluation_traces()
+    vec_env = VecEnoEnv(ENV_NAME)
+    vec_env.reset(traces, SEEDS=SEEDS)
+    return run_policy(vec_env, policy, obs_fn)
+
+def run_policy(vec_env, policy, obs_fn=None):
+    # evaluate_policy() on a VecEnoEnv that has just been reset
+    obs = vec_env.get_obs()
+    reward_sum = np.zeros(vec_env.NO_OF_NODES)
+    step_count = np.zeros(vec_env.NO_OF_NODES, dtype=int)
+    recovery_count = np.zeros(vec_env.NO_OF_NODES, dtype=int)
+    done = vec_env.done.copy()
+    while not done.all():
+        active = ~done
+        action = policy(obs if obs_fn is None else obs_fn(obs))
+        obs, reward, done, _ = vec_env.step(action)
+        reward_sum += reward
+        step_count += active
+        recovery_count += active & vec_env.RECOVERY_MODE
+
+    return pd.DataFrame({'location':       [location for location, _ in vec_env.nodes],
+                         'year':           [year for _, year in vec_env.nodes],
+                         'avg_reward':     reward_sum/step_count,
+                         'eno_perf':       vec_env.eno_sum,
+                         'recovery_days':  recovery_count/len(vec_env.env_timeslot_values)})
+########################################################
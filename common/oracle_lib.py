@@ -0,0 +1,371 @@
+########################################################
+# Offline-optimal duty cycle schedules by dynamic programming
+########################################################
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from common import env_lib, reward_lib
+from common.vec_env_lib import VecEnoEnv
+from common.eval_fn import evaluation_traces, run_policy
+
+########################################################
+# Backward dynamic programming over (battery x recovery flag)
+########################################################
+# With the harvest trace known in advance, the value of a node at timeslot t only depends on its
+# battery observation b and its recovery flag:
+#     recovery  : V_rec(t, b)  = R_rec + GAMMA*W(t+1, b + henergy*HFACTOR)
+#     otherwise : V_norm(t, b) = max over the duty cycles of
+#                     R(b) + GAMMA*V_norm(t+1, min(b + surplus, 1))   if the action is valid
+#                     V_rec(t, b)                                      if not (the node goes into recovery mode)
+#                 and V_norm(t, b) = V_rec(t, b) if b < MIN_BATT
+# where W = V_norm above BINIT (snap out of recovery mode) and V_rec otherwise. R is the reward of
+# the env, which must only depend on the observation of the step (env_lib.eno_v0.MACRO_STEP_REWARDS).
+#
+# V is kept on a battery lattice that moves with the harvest: at timeslot t the lattice points are
+# b = (psi_t + k)*STEP, k = 0..NO_OF_BINS-2, and psi_{t+1} = psi_t + henergy*HFACTOR/STEP (mod 1).
+# STEP divides the discharge of every duty cycle, so every transition lands exactly on a lattice
+# point of t+1 and no interpolation is needed, except from a full battery (b = 1, kept as one more
+# state per node) which is off the lattice. An action shifts the whole lattice by its discharge, so
+# the max over the duty cycles is a sliding window max over V(t+1), taken for all the nodes at once,
+# together with its argmax: the optimal action of every lattice point.
+# The values are float32, relative to a float64 offset per node that is reset every CHUNK timeslots.
+# The dynamics are those of the env, so the DP value is the value of the optimal schedule up to the
+# float32 rounding and the interpolation from a full battery: an estimate, not a bound.
+# The default lattice has 1001 points for eno_v0 and eno_v0_T24 (a discharge step of 0.001 or 0.005).
+class lattice_dp(object):
+    # Backward DP of the nodes of vec_env (just reset, all at the same timeslot).
+    # solve() runs the backward pass once and keeps the optimal actions of every timeslot,
+    # run-length encoded over (node x lattice point), plus the action from a full battery;
+    # act() looks up the actions of the observed batteries, so the replay does not solve again.
+    # A battery off the lattice (after a full battery) takes the action of the nearest lattice point.
+    def __init__(self, vec_env, NO_OF_BINS=None, GAMMA=1.0, CHUNK=None):
+        env_class = vec_env.env_class
+        REWARD_NAME = reward_lib.reward_class(env_class).__name__
+        assert REWARD_NAME in env_lib.eno_v0.MACRO_STEP_REWARDS, 'The reward of ' + REWARD_NAME + ' depends on the history'
+        assert vec_env.BEFF == 1.0, 'The battery lattice needs BEFF = 1'
+        assert vec_env.NO_OF_DUTY_CYCLES <= 127, 'The actions are stored as int8'
+        self.vec_env = vec_env
+        self.GAMMA = GAMMA
+        NO_OF_NODES = vec_env.NO_OF_NODES
+        NO_OF_DUTY_CYCLES = vec_env.NO_OF_DUTY_CYCLES
+        self.node = np.arange(NO_OF_NODES)
+
+        # Lattice step: divides the discharge of every duty cycle (default: the coarsest one up to 0.001)
+        DC_STEP = vec_env.DFACTOR/NO_OF_DUTY_CYCLES # discharge between two consecutive duty cycles
+        if NO_OF_BINS is None:
+            NO_OF_BINS = int(round(np.ceil(DC_STEP/0.001 - 1e-9)/DC_STEP)) + 1
+        self.NO_OF_BINS = NO_OF_BINS
+        self.STEP = STEP = 1/(NO_OF_BINS-1)
+        self.DC_BINS = int(round(DC_STEP/STEP))
+        self.MIN_DC_BINS = int(round(vec_env.MIN_DC*vec_env.DFACTOR/STEP)) # discharge of action 0
+        assert (abs(self.DC_BINS*STEP - DC_STEP) < 1e-9*DC_STEP and
+                abs(self.MIN_DC_BINS*STEP - vec_env.MIN_DC*vec_env.DFACTOR) < 1e-9), \
+            'The discharge of every duty cycle must be a multiple of 1/(NO_OF_BINS-1)'
+        self.discharge = (np.arange(NO_OF_DUTY_CYCLES)/NO_OF_DUTY_CYCLES + vec_env.MIN_DC)*vec_env.DFACTOR
+        self.action_bins = self.MIN_DC_BINS + self.DC_BINS*np.arange(NO_OF_DUTY_CYCLES) # discharge of each action
+
+        # Lattice indices: K points per node, LEFT/RIGHT pads for the discharges and the harvest
+        self.K = K = NO_OF_BINS - 1
+        self.LEFT = LEFT = self.action_bins[-1]
+        RIGHT = int(np.ceil(vec_env.henergy_stream.max()*vec_env.HFACTOR/STEP)) + 1
+        self.S = S = LEFT + K + RIGHT # padded row of V_norm; entries beyond the lattice hold V(b = 1)
+        self.KR = min(K, int(np.ceil(max(vec_env.BINIT, self.discharge[-1])/STEP)) + 2) # bins of V_rec
+        XW = min(S, LEFT + self.KR + RIGHT) # columns of the recovery arrival values
+
+        # Rewards on the lattice: R(psi, k) = R[k] + psi*dR[k], exact for the piecewise linear
+        # eno rewards, whose kinks lie on multiples of STEP; taken as the matrix product
+        # [1, psi] x [R, dR] (one pass, faster than broadcasting psi over the rows)
+        grid = np.arange(K+2)*STEP
+        reward, self.recovery_reward = grid_rewards(env_class, grid)
+        self.reward_basis = np.array([reward[:K], np.diff(reward)[:K]], dtype=np.float32)
+        self.reward_weights = np.ones((NO_OF_NODES, 2), dtype=np.float32)
+        self.reward_rows = np.zeros((NO_OF_NODES, K), dtype=np.float32)
+        self.full_reward = reward[K] # R(1)
+        self.grid = grid
+        self.grid_reward = reward
+
+        # Lattice phase psi and harvest shift of every timeslot (timeslot - start x node):
+        # b + henergy*HFACTOR moves k to k + shift
+        self.start = start = int(vec_env.global_time.min())
+        assert np.all(vec_env.global_time == start), 'The nodes must start from the same timeslot'
+        self.stop = stop = int(vec_env.last_time.max()) # V = 0 from the last timeslot of each trace on
+        harvested_energy = vec_env.henergy_stream[:,start:stop].T*vec_env.HFACTOR
+        position = vec_env.batt/STEP + np.concatenate((np.zeros((1,NO_OF_NODES)),
+                                                       np.cumsum(harvested_energy/STEP, axis=0)))
+        floor = np.floor(position)
+        self.psi = position - floor
+        self.shift = np.diff(floor, axis=0).astype(np.int64)
+        self.harvested_energy = harvested_energy
+        self.low = lattice_count(self.psi[:-1], vec_env.MIN_BATT, STEP) # lattice points below MIN_BATT
+        self.stay = lattice_count(self.psi[1:], vec_env.BINIT, STEP, INCLUDE_EQUAL=True) # ... not above BINIT at t+1
+        self.valid_from = lattice_count(self.psi[:-1], self.discharge[-1] - harvested_energy, STEP,
+                                        INCLUDE_EQUAL=True) # ... where the last duty cycle is not valid
+        self.INVALID = (self.valid_from > self.low).any(axis=1) # timeslots with invalid actions above MIN_BATT
+        self.first_end = int(vec_env.last_time.min())
+        self.CHUNK = len(vec_env.env_timeslot_values) if CHUNK is None else CHUNK
+
+        # Scratch buffers of step_back(): the windows of window_max() and their argmax, with row views
+        self.window_plan = window_plan(NO_OF_DUTY_CYCLES)
+        NO_OF_WINDOWS = max(len(self.window_plan), 1)
+        self.window_buffers = [np.zeros(NO_OF_NODES*S, dtype=np.float32) for _ in range(NO_OF_WINDOWS)]
+        self.argmax_buffers = [np.zeros(NO_OF_NODES*S, dtype=np.int8) for _ in range(NO_OF_WINDOWS+3)]
+        self.window_rows = sliding_window_view(self.window_buffers[-1].reshape(NO_OF_NODES, S), K, axis=1)
+        self.argmax_rows = sliding_window_view(self.argmax_buffers[NO_OF_WINDOWS-1].reshape(NO_OF_NODES, S), K, axis=1)
+        self.no_action = np.zeros((NO_OF_NODES, K), dtype=np.int8)
+        self.run_changes = np.ones(NO_OF_NODES*K, dtype=bool) # run starts of the actions of a timeslot
+        self.arrival = np.zeros((NO_OF_NODES, XW), dtype=np.float32)
+        self.arrival_rows = sliding_window_view(self.arrival, self.KR, axis=1)
+
+    def new_values(self):
+        # V_norm (padded rows), V_rec, V(b = 1) and the offset of every node
+        NO_OF_NODES = len(self.node)
+        return (np.zeros((NO_OF_NODES, self.S), dtype=np.float32),
+                np.zeros((NO_OF_NODES, self.KR), dtype=np.float32),
+                np.zeros(NO_OF_NODES),
+                np.zeros(NO_OF_NODES))
+
+    def step_back(self, timeslot, next_values, values):
+        # values of timeslot from those of timeslot+1; returns the optimal actions
+        # (node x lattice point, and from a full battery)
+        V_norm_next, V_rec_next, V_full_next, offset_next = next_values
+        V_norm, V_rec, V_full, offset = values
+        GAMMA, K, LEFT = self.GAMMA, self.K, self.LEFT
+        node = self.node
+        index = timeslot - self.start
+        shift, low = self.shift[index], self.low[index]
+        surplus = self.harvested_energy[index][:,None] - self.discharge
+
+        # duty cycles: sliding window max of V_norm(t+1) over the discharges, shifted by the harvest
+        V_norm_next[:,LEFT+K:] = V_full_next[:,None] # a full battery stays full
+        window_max(V_norm_next.ravel(), self.window_buffers, self.argmax_buffers, self.window_plan, self.DC_BINS)
+        window = LEFT - self.MIN_DC_BINS + shift
+        best = self.window_rows[node, window]
+        action = self.argmax_rows[node, window]
+        if GAMMA != 1.0:
+            best *= GAMMA
+        self.reward_weights[:,1] = self.psi[index]
+        np.matmul(self.reward_weights, self.reward_basis, out=self.reward_rows)
+        norm = V_norm[:,LEFT:LEFT+K]
+        np.add(best, self.reward_rows, out=norm)
+
+        # recovery step: arrive in recovery mode not above BINIT, in normal mode above it
+        arrival = self.arrival
+        arrival[:,LEFT:LEFT+self.KR] = V_rec_next
+        arrival[:,LEFT+self.KR:] = V_norm_next[:,LEFT+self.KR:arrival.shape[1]]
+        fill_rows(arrival[:,LEFT:LEFT+self.KR], V_norm_next[:,LEFT:LEFT+self.KR], self.stay[index], FROM_END=True)
+        arrived = self.arrival_rows[node, LEFT + shift]
+        if GAMMA != 1.0:
+            arrived *= GAMMA
+        np.add(arrived, self.recovery_reward, out=V_rec)
+
+        # low battery: recovery mode whatever the action (0, which the env ignores)
+        fill_rows(norm, V_rec, low)
+        fill_rows(action, self.no_action, low)
+
+        # lattice points above MIN_BATT where some duty cycles are not valid: masked max over
+        # (node x lattice point x duty cycle); the last duty cycle, not valid there, stands for recovery mode
+        if self.INVALID[index]:
+            bins = low[:,None] + np.arange(int((self.valid_from[index] - low).max()))
+            INSIDE = bins < self.valid_from[index][:,None]
+            bins = np.minimum(bins, K-1)
+            batt = (self.psi[index][:,None] + bins)*self.STEP
+            next_index = LEFT + (bins + shift[:,None])[:,:,None] - self.action_bins
+            VALID = -surplus[:,None,:] < batt[:,:,None]
+            q = np.where(VALID, V_norm_next[node[:,None,None], np.maximum(next_index, 0)]*np.float32(GAMMA), -np.inf)
+            best_action = q.argmax(axis=2)
+            q = np.interp(batt, self.grid, self.grid_reward) + np.take_along_axis(q, best_action[:,:,None], axis=2)[:,:,0]
+            recovery = V_rec[node[:,None], bins]
+            RECOVERY = recovery > q
+            rows = np.broadcast_to(node[:,None], bins.shape)[INSIDE]
+            norm[rows, bins[INSIDE]] = np.where(RECOVERY, recovery, q)[INSIDE]
+            action[rows, bins[INSIDE]] = np.where(RECOVERY, len(self.discharge)-1, best_action)[INSIDE]
+
+        # full battery
+        next_value = lattice_value(V_norm_next, self.psi[index+1], np.minimum(1 + surplus, 1), self)
+        full_action = next_value.argmax(axis=1)
+        V_full[:] = self.full_reward + GAMMA*next_value[node, full_action]
+
+        # nodes whose trace has ended
+        np.multiply(offset_next, GAMMA, out=offset)
+        if timeslot >= self.first_end:
+            ENDED = self.vec_env.last_time <= timeslot
+            V_norm[ENDED] = 0
+            V_rec[ENDED] = 0
+            V_full[ENDED] = 0
+            offset[ENDED] = 0
+        return action, full_action
+
+    def normalize(self, values):
+        # moves V(b = 1) into the offsets
+        V_norm, V_rec, V_full, offset = values
+        V_norm -= V_full[:,None].astype(np.float32)
+        V_rec -= V_full[:,None].astype(np.float32)
+        offset += V_full
+        V_full[:] = 0
+
+    def solve(self):
+        # backward pass over the whole trace, keeping the optimal actions of every timeslot:
+        # run starts (flat node*K + lattice point) and actions of each timeslot, concatenated
+        NO_OF_TIMESLOTS = self.stop - self.start
+        run_starts, run_actions = [None]*NO_OF_TIMESLOTS, [None]*NO_OF_TIMESLOTS
+        self.full_action = np.zeros((NO_OF_TIMESLOTS, len(self.node)), dtype=np.int8)
+        values = self.new_values()
+        next_values = self.new_values()
+        for timeslot in range(self.stop-1, self.start-1, -1):
+            index = timeslot - self.start
+            action, self.full_action[index] = self.step_back(timeslot, next_values, values)
+            action = action.ravel()
+            np.not_equal(action[1:], action[:-1], out=self.run_changes[1:])
+            run_starts[index] = np.flatnonzero(self.run_changes).astype(np.int32)
+            run_actions[index] = action[run_starts[index]]
+            if index % self.CHUNK == 0:
+                self.normalize(values)
+            values, next_values = next_values, values
+        self.run_offsets = np.cumsum([0] + [len(starts) for starts in run_starts])
+        self.run_starts = np.concatenate(run_starts)
+        self.run_actions = np.concatenate(run_actions)
+        self.start_value = self.value(self.vec_env.batt, 0, next_values)
+        return self.start_value
+
+    def value(self, batt, index, values):
+        # value of the nodes in normal mode with battery batt, at timeslot start+index
+        V_norm, _, V_full, offset = values
+        V_norm[:,self.LEFT+self.K:] = V_full[:,None]
+        return lattice_value(V_norm, self.psi[index], batt[:,None], self)[:,0] + offset
+
+    def act(self, obs, timeslot):
+        # optimal duty cycle actions of the nodes at timeslot, from their observations
+        if timeslot >= self.stop:
+            return np.zeros(len(self.node), dtype=np.int64)
+        index = timeslot - self.start
+        batt = obs[:,3]
+        k = np.clip(np.rint(batt/self.STEP - self.psi[index]).astype(np.int64), 0, self.K-1)
+        first, last = self.run_offsets[index], self.run_offsets[index+1]
+        run = np.searchsorted(self.run_starts[first:last], self.node*self.K + k, side='right') - 1
+        action = self.run_actions[first:last][run]
+        return np.where(batt >= 1, self.full_action[index], action).astype(np.int64)
+# End of lattice_dp
+########################################################
+
+def window_plan(NO_OF_DUTY_CYCLES):
+    # maxima of window_max(): (covered actions of the left operand, of the right operand) >> covered actions
+    plan, covered = [], 1
+    while 2*covered <= NO_OF_DUTY_CYCLES:
+        plan.append((covered, covered))
+        covered *= 2
+    for size in [2**p for p in range(len(plan))][::-1]:
+        if covered + size <= NO_OF_DUTY_CYCLES:
+            plan.append((covered, size))
+            covered += size
+    return plan
+
+def window_max(V, buffers, argmax_buffers, plan, DC_BINS):
+    # buffers[-1][j] = max(V[j - a*DC_BINS] for a in range(NO_OF_DUTY_CYCLES)) for j >= (NO_OF_DUTY_CYCLES-1)*DC_BINS,
+    # by doubling the window, and argmax_buffers[len(buffers)-1][j] the smallest maximizing a; buffers and
+    # argmax_buffers hold the windows of the steps of plan (the entries below j are not set), followed by
+    # the argmax of single actions (0) and two scratch buffers
+    single, right_mask, scratch = argmax_buffers[-3], argmax_buffers[-2].view(bool), argmax_buffers[-1]
+    if not plan:
+        buffers[0][:] = V
+        argmax_buffers[0][:] = 0
+    windows = {1: (V, single)}
+    for buffer, argmax, (left, right) in zip(buffers, argmax_buffers, plan):
+        lag = left*DC_BINS
+        left_max, left_argmax = windows[left]
+        right_max, right_argmax = windows[right]
+        np.maximum(left_max[lag:], right_max[:-lag], out=buffer[lag:])
+        if left == 1: # pairs of single actions: the argmax is the comparison
+            np.greater(right_max[:-lag], left_max[lag:], out=argmax[lag:].view(bool))
+        else: # argmax = left_argmax + RIGHT*(right_argmax + left - left_argmax), in int8
+            RIGHT = np.greater(right_max[:-lag], left_max[lag:], out=right_mask[lag:]) # strictly: ties keep the smaller action
+            np.subtract(right_argmax[:-lag], left_argmax[lag:], out=scratch[lag:])
+            scratch[lag:] += np.int8(left)
+            scratch[lag:] *= RIGHT.view(np.int8)
+            np.add(left_argmax[lag:], scratch[lag:], out=argmax[lag:])
+        windows[left + right] = (buffer, argmax)
+
+def lattice_count(psi, level, STEP, INCLUDE_EQUAL=False):
+    # number of lattice points (psi + k)*STEP, k >= 0, below level (or not above it, with INCLUDE_EQUAL)
+    count = np.maximum(np.floor(level/STEP - psi), -1).astype(np.int64) + 1
+    below = (psi + count - 1)*STEP
+    count -= (below > level) if INCLUDE_EQUAL else (below >= level)
+    above = (psi + count)*STEP
+    count += (above <= level) if INCLUDE_EQUAL else (above < level)
+    return np.maximum(count, 0)
+
+def fill_rows(target, source, count, FROM_END=False):
+    # target[n, :count[n]] = source[n, :count[n]] (or target[n, count[n]:] = source[n, count[n]:], FROM_END):
+    # the columns of all the rows as a block, the ragged ones under a mask
+    first, last = int(count.min()), int(count.max())
+    if FROM_END:
+        target[:,last:] = source[:,last:]
+    else:
+        target[:,:first] = source[:,:first]
+    if first < last:
+        INSIDE = np.arange(first, last) < count[:,None]
+        np.copyto(target[:,first:last], source[:,first:last], where=~INSIDE if FROM_END else INSIDE)
+
+def lattice_value(V_norm, psi, batt, dp):
+    # padded V_norm (with V(b = 1) beyond the lattice) at the batteries batt (node x any),
+    # linearly interpolated between the lattice points and the full battery
+    x = batt/dp.STEP - psi[:,None] # in lattice points
+    k = np.minimum(x.astype(np.int64), dp.K-1)
+    flat_index = k + (dp.node*dp.S + dp.LEFT)[:,None]
+    V_norm = V_norm.ravel()
+    lower = V_norm[flat_index].astype(np.float64)
+    upper = V_norm[flat_index + 1]
+    weight = x - k
+    TOP = k == dp.K-1 # from the last lattice point to b = 1: 1 - psi lattice steps
+    if TOP.any():
+        weight = np.where(TOP, weight/(1 - psi)[:,None], weight)
+    return lower + np.clip(weight, 0, 1)*(upper - lower)
+
+def grid_rewards(env_class, grid):
+    # R(b) on the battery grid and R_rec, from the rewards of reward_lib
+    env = env_class()
+    obs = np.zeros((len(grid)+1, 4))
+    obs[:-1,3] = grid
+    recovery = np.zeros(len(grid)+1, dtype=bool)
+    recovery[-1] = True
+    trajectory = reward_lib.Trajectory(obs, np.zeros(len(obs)), recovery, obs, recovery)
+    rewards = reward_lib.relabel(trajectory, env)
+    return rewards[:-1], rewards[-1]
+
+def solve_dp(vec_env, NO_OF_BINS=None, GAMMA=1.0, CHUNK=None):
+    # vec_env: a VecEnoEnv that has just been reset. Returns the solved lattice_dp;
+    # its start_value is the DP value of each node at its first observation
+    dp = lattice_dp(vec_env, NO_OF_BINS, GAMMA, CHUNK)
+    dp.solve()
+    return dp
+
+def dp_policy(dp):
+    # batch policy for eval_fn.run_policy() on the vec_env of dp: the optimal action at each timeslot
+    timeslot = [dp.start]
+    def act(obs):
+        action = dp.act(obs, timeslot[0])
+        timeslot[0] += 1
+        return action
+    return act
+
+########################################################
+# Oracle baseline over many traces
+########################################################
+def evaluate_oracle(ENV_NAME='eno_v0', traces=None, NO_OF_BINS=None, GAMMA=1.0, SEEDS=None, BATCH_SIZE=64):
+    # eval_fn.evaluate_policy() table of the DP policy of every trace (default: all of solar_data/),
+    # solved and run BATCH_SIZE traces at a time, with the DP estimate of the value of the first
+    # observation (dp_value; the sum of the rewards of the run for GAMMA = 1)
+    if traces is None:
+        traces = evaluation_traces()
+    tables = []
+    for batch_start in range(0, len(traces), BATCH_SIZE):
+        batch = traces[batch_start:batch_start+BATCH_SIZE]
+        vec_env = VecEnoEnv(ENV_NAME)
+        vec_env.reset(batch, SEEDS=None if SEEDS is None else SEEDS[batch_start:batch_start+BATCH_SIZE])
+        dp = solve_dp(vec_env, NO_OF_BINS, GAMMA)
+        table = run_policy(vec_env, dp_policy(dp))
+        table['dp_value'] = dp.start_value
+        tables.append(table)
+        del dp
+    return pd.concat(tables, ignore_index=True)
+########################################################
@@ -0,0 +1,196 @@
+########################################################
+# Offline reward relabeling
+# Recomputes a reward function over a whole logged trajectory in one vectorized pass
+########################################################
+import collections
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+########################################################
+# Trajectory
+########################################################
+# One entry per env.step():
+#     obs           : observation the step was taken on (env_log[:-1])
+#     sense_dc      : duty cycle of the action (action_log); ignored in recovery mode
+#     recovery      : RECOVERY_MODE when the reward was computed (action_log == -1)
+#     next_obs      : observation returned by the step (env_log[1:])
+#     next_recovery : RECOVERY_MODE after the step, seen by the reward wrappers
+# obs/next_obs are raw env observations (not normalized by the observation wrappers).
+Trajectory = collections.namedtuple('Trajectory', field_names=['obs', 'sense_dc', 'recovery', 'next_obs', 'next_recovery'])
+
+def env_trajectory(env):
+    # Trajectory of the episode logged by env (reset with LOG_DATA=True)
+    env_log = np.asarray(env.env_log)
+    action_log = np.asarray(env.action_log)
+    obs = env_log[:len(action_log)]
+    next_obs = env_log[1:len(action_log)+1]
+    recovery = action_log == -1
+    # next_obs: the battery observation is not updated on the last timeslot of the trace
+    updated = np.ones(len(action_log), dtype=bool)
+    if env.env_harvester.global_time == env.env_harvester.last_time:
+        updated[-1] = False
+    next_recovery = recovery & ~(updated & (next_obs[:,3] > env.BINIT)) # snap out of recovery mode
+    return Trajectory(obs, action_log, recovery, next_obs, next_recovery)
+
+def action_sense_dc(env, action):
+    # duty cycle of discrete actions, e.g. of the actions stored in a replay buffer
+    return np.asarray(action)/env.NO_OF_DUTY_CYCLES + env.MIN_DC
+
+########################################################
+# Registry of reward functions: reward(trajectory, env) >> one reward per step
+########################################################
+# env provides the constants (MIN_BATT, READINGS_PER_DAY, env_timeslot_values, ...) of the env that was reset.
+# Rewards of the environments are registered under the class that defines reward()
+# (see reward_class()), and those of the reward wrappers under the wrapper name.
+REWARDS = {}
+
+def register_reward(*names):
+    def register(reward_fn):
+        for name in names:
+            REWARDS[name] = reward_fn
+        return reward_fn
+    return register
+
+def reward_class(env_class):
+    # the class in the MRO of env_class whose reward() is used
+    for base in env_class.__mro__:
+        if 'reward' in vars(base):
+            return base
+
+def relabel(trajectory, env, name=None):
+    # rewards of trajectory under the reward registered as name (default: the reward of env)
+    if name is None:
+        name = reward_class(type(env)).__name__
+    assert name in REWARDS, 'No reward registered as ' + str(name)
+    return REWARDS[name](trajectory, env)
+
+def day_end_time(env):
+    # time observation of the last timeslot of a day, as it appears in obs[:,0]
+    return env.env_timeslot_values[-1]/env.READINGS_PER_DAY
+
+########################################################
+# eno_v0 family
+########################################################
+def eno_reward(trajectory, scale=None):
+    benergy = trajectory.obs[:,3]
+    reward = (0.5 - np.abs(benergy - 0.5))*4 - 1 # symmetric linear reward
+    if scale is not None:
+        reward = reward*scale
+    return np.where(trajectory.recovery, -1, reward)
+
+@register_reward('eno_v0')
+def eno_v0_reward(trajectory, env):
+    return eno_reward(trajectory)
+
+@register_reward('eno_v0_g99', 'eno_v0_g999a')
+def eno_v0_g99_reward(trajectory, env):
+    return eno_reward(trajectory, 0.1)
+
+@register_reward('eno_v0_g999')
+def eno_v0_g999_reward(trajectory, env):
+    return eno_reward(trajectory, 0.01)
+
+@register_reward('sparse_day_window')
+def sparse_v0_reward(trajectory, env):
+    # sparse_v0_*: mean battery observation of the previous TIMESLOTS_PER_DAY-1 steps at the REWARD_QUARTERS of the day
+    TIMESLOTS_PER_DAY = len(env.env_timeslot_values)
+    reward_times = [env.env_timeslot_values[-1] if quarter == 4 else env.env_timeslot_values[int(quarter*TIMESLOTS_PER_DAY/4)]
+                    for quarter in env.REWARD_QUARTERS]
+    reward_times = np.array(reward_times)/env.READINGS_PER_DAY
+    benergy = trajectory.obs[:,3]
+    reward_steps = np.flatnonzero(np.isin(trajectory.obs[:,0], reward_times))
+
+    mean_day_batt = np.full(len(reward_steps), np.nan)
+    full_day = reward_steps >= TIMESLOTS_PER_DAY-1
+    if full_day.any():
+        day_windows = sliding_window_view(benergy, TIMESLOTS_PER_DAY-1)
+        mean_day_batt[full_day] = day_windows[reward_steps[full_day]+1-TIMESLOTS_PER_DAY].mean(axis=1)
+    for index in np.flatnonzero(~full_day & (reward_steps > 0)): # first day of the trajectory
+        mean_day_batt[index] = np.mean(benergy[:reward_steps[index]])
+
+    lowthreshold = 2*env.MIN_BATT
+    reward = np.zeros(len(benergy))
+    reward[reward_steps] = np.where((lowthreshold<mean_day_batt) & (mean_day_batt<(1-lowthreshold)), 1, -1)
+    return np.where(trajectory.recovery, -1, reward)
+
+########################################################
+# utility family
+########################################################
+@register_reward('utility_v0_T240')
+def utility_v0_reward(trajectory, env):
+    utility = trajectory.obs[:,4]
+    return np.where(trajectory.recovery, -1, np.minimum(1, trajectory.sense_dc/utility))
+
+@register_reward('utility_v0a_T24')
+def utility_v0a_reward(trajectory, env): # reward = util*sense_dc
+    utility = trajectory.obs[:,4]
+    return np.where(trajectory.recovery, -1, trajectory.sense_dc*utility)
+
+@register_reward('utility_v0b_T24')
+def utility_v0b_reward(trajectory, env): # reward based utility-sense_dc
+    utility = trajectory.obs[:,4]
+    del_qos = utility - trajectory.sense_dc
+    return np.where(trajectory.recovery, -1, np.where(del_qos <= 0, 1, 1-del_qos/0.9))
+
+@register_reward('utility_v0c_T24')
+def utility_v0c_reward(trajectory, env): # reward based utility-sense_dc
+    utility = trajectory.obs[:,4]
+    del_qos = utility - trajectory.sense_dc
+    return np.where(trajectory.recovery, -1, np.where(del_qos <= 0, utility, 1-del_qos/0.9))
+
+@register_reward('utility_v2a_T24', 'utility_v3a_T24')
+def utility_v2a_reward(trajectory, env):
+    utility = trajectory.obs[:,4]
+    sense_dc = trajectory.sense_dc
+    return np.where(trajectory.recovery, -1, np.where(sense_dc >= utility, utility, sense_dc))
+
+@register_reward('utility_v2b_T24', 'utility_v3b_T24')
+def utility_v2b_reward(trajectory, env):
+    utility = trajectory.obs[:,4]
+    sense_dc = trajectory.sense_dc
+    return np.where(trajectory.recovery, -1, np.where(sense_dc >= utility, utility, sense_dc *0.5))
+
+########################################################
+# Reward wrappers (wrappers.py)
+########################################################
+# The wrappers compute their reward after env.step(), i.e. on the next observation and the
+# recovery flag after the step. sparse_reward* take the battery observation TIMESLOTS_PER_DAY-2
+# steps back (batt_log[1-TIMESLOTS_PER_DAY]), not a mean over the day; both are kept as they are.
+@register_reward('non_symmetric_reward')
+def non_symmetric_reward(trajectory, env):
+    benergy = trajectory.next_obs[:,3]
+    reward = np.where(benergy < 0.5, 5*benergy-1.5, -2*(benergy-1))
+    return np.where(trajectory.next_recovery, -1, reward)
+
+def wrapper_day_batt(trajectory, env):
+    # batt_log[1-TIMESLOTS_PER_DAY] of the log up to the next observation (nan where the log is too short)
+    TIMESLOTS_PER_DAY = len(env.env_timeslot_values)
+    benergy = np.concatenate((trajectory.obs[:1,3], trajectory.next_obs[:,3])) # env_log[:,3]
+    log_index = np.arange(len(trajectory.next_obs)) + 3 - TIMESLOTS_PER_DAY
+    day_batt = np.full(len(log_index), np.nan)
+    day_batt[log_index >= 0] = benergy[log_index[log_index >= 0]]
+    return day_batt
+
+def wrapper_sparse_reward(trajectory, env, lowthreshold, LOW_REWARD=None):
+    day_batt = wrapper_day_batt(trajectory, env)
+    day_reward = np.where((lowthreshold<day_batt) & (day_batt<(1-lowthreshold)), 1, -1 if LOW_REWARD is None else LOW_REWARD)
+    reward = np.where(trajectory.next_obs[:,0] == day_end_time(env), day_reward, 0)
+    return np.where(trajectory.next_recovery, -1, reward)
+
+@register_reward('sparse_reward')
+def sparse_reward(trajectory, env):
+    return wrapper_sparse_reward(trajectory, env, 3*env.MIN_BATT)
+
+@register_reward('sparse_reward_v2')
+def sparse_reward_v2(trajectory, env):
+    return wrapper_sparse_reward(trajectory, env, env.MIN_BATT)
+
+@register_reward('sparse_reward_v2a')
+def sparse_reward_v2a(trajectory, env):
+    return wrapper_sparse_reward(trajectory, env, env.MIN_BATT*2)
+
+@register_reward('sparse_reward_v3')
+def sparse_reward_v3(trajectory, env):
+    day_batt = wrapper_day_batt(trajectory, env)
+    return wrapper_sparse_reward(trajectory, env, env.MIN_BATT, LOW_REWARD=1.5-5*np.abs(day_batt-0.5))
+########################################################
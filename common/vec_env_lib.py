@@ -0,0 +1,190 @@
+########################################################
+# Vectorized environments: many nodes stepped in lock-step
+########################################################
+import numpy as np
+
+from common import env_lib
+from common.reward_lib import reward_class
+
+########################################################
+# Rewards of the eno_v0 family, by the class that defines reward()
+########################################################
+# ('dense', scale)     : ((0.5 - |benergy - 0.5|)*4 - 1)*scale
+# ('sparse', None)     : +1/-1 (mean battery of the last day inside/outside [2*MIN_BATT, 1-2*MIN_BATT])
+#                        at the REWARD_QUARTERS of the day of the env (4 = last timeslot of the day), 0 otherwise
+# All of them give -1 in recovery mode.
+VEC_REWARDS = {
+    'eno_v0':             ('dense', 1),
+    'eno_v0_g99':         ('dense', 0.1),
+    'eno_v0_g999':        ('dense', 0.01),
+    'eno_v0_g999a':       ('dense', 0.1),
+    'sparse_day_window':  ('sparse', None), # sparse_v0_*
+}
+
+########################################################
+# VecEnoEnv: batch of eno_v0-family environments
+########################################################
+class VecEnoEnv(object):
+    # Steps NO_OF_NODES independent nodes (one (location, year) trace each) of an eno_v0-family env.
+    # Battery, recovery flags and observations are arrays over the nodes, and step() reproduces
+    # eno_v0.step() (verify_action >> execute_action/recovery_action >> reward >> next_obs) for all of them.
+    #     obs                       : NO_OF_NODES x 4 array, rows as returned by the scalar env
+    #     action                    : NO_OF_NODES ints; ignored for the nodes in recovery mode
+    #     reward, done              : NO_OF_NODES arrays
+    # Nodes run from the first timeslot of their trace in lock-step. A node whose trace has ended
+    # (e.g. a 365-day year next to a leap year) is frozen: done stays True, its reward is 0 and its obs is unchanged.
+    # eno_sum and recovery_steps accumulate eno_log (its cumsum) and the number of recovery timeslots.
+    def __init__(self, ENV_NAME='eno_v0'):
+        self.ENV_NAME = ENV_NAME
+        self.env_class = getattr(env_lib, ENV_NAME)
+        REWARD_NAME = reward_class(self.env_class).__name__
+        assert REWARD_NAME in VEC_REWARDS, 'Reward of ' + REWARD_NAME + ' is not vectorized'
+        self.REWARD_TYPE, self.REWARD_PARAM = VEC_REWARDS[REWARD_NAME]
+        if self.REWARD_TYPE == 'sparse':
+            self.REWARD_PARAM = self.env_class.REWARD_QUARTERS
+
+        env = self.env_class()
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+        self.NO_OF_DUTY_CYCLES = env.NO_OF_DUTY_CYCLES
+        self.MIN_BATT = env.MIN_BATT
+        self.MIN_DC = env.MIN_DC
+        self.HFACTOR = env.HFACTOR
+        self.DFACTOR = env.DFACTOR
+
+    def reset(self, nodes, SEEDS=None):
+        # nodes : list of (location, year)
+        # SEEDS : optional list of per-node seeds for the harvester noise (default: the global np.random)
+        self.nodes = list(nodes)
+        NO_OF_NODES = len(self.nodes)
+        self.NO_OF_NODES = NO_OF_NODES
+
+        # One scalar env per node characterizes the harvester and the battery;
+        # only its streams are kept, so that a large batch does not hold every harvester's step lists
+        streams = []
+        for node, (location, year) in enumerate(self.nodes):
+            assert np.ndim(year) == 0, 'VecEnoEnv runs one year per node'
+            env = self.env_class()
+            if SEEDS is not None:
+                env.harvester_rng = np.random.RandomState(SEEDS[node])
+            env.reset(location, year, LOG_DATA=False)
+            harvester = env.env_harvester
+            streams.append((harvester.time_stream, harvester.henergy_stream, harvester.penergy_stream,
+                            harvester.global_time, env.ENV_LIFETIME, env.env_battery.batt))
+        self.READINGS_PER_DAY = env.READINGS_PER_DAY
+        self.env_timeslot_values = env.env_timeslot_values
+        self.BINIT = env.BINIT
+        self.BEFF = env.BEFF
+        self.ENV_LIFETIME = np.array([stream[4] for stream in streams])
+
+        # Harvester streams, node x timeslot (padded to the longest trace)
+        TRACE_LENGTH = max(len(stream[1]) for stream in streams)
+        self.time_stream = np.zeros((NO_OF_NODES, TRACE_LENGTH))
+        self.henergy_stream = np.zeros((NO_OF_NODES, TRACE_LENGTH))
+        self.penergy_stream = np.zeros((NO_OF_NODES, TRACE_LENGTH))
+        for node, (time_stream, henergy_stream, penergy_stream, _, _, _) in enumerate(streams):
+            self.time_stream[node,:len(time_stream)] = time_stream
+            self.henergy_stream[node,:len(henergy_stream)] = henergy_stream
+            self.penergy_stream[node,:len(penergy_stream)] = penergy_stream
+        self.last_time = np.array([len(stream[1])-1 for stream in streams])
+        self.global_time = np.array([stream[3] for stream in streams])
+        self.node_index = np.arange(NO_OF_NODES)
+
+        # Battery and flags
+        self.batt = np.array([stream[5] for stream in streams], dtype=np.float64)
+        self.RECOVERY_MODE = np.zeros(NO_OF_NODES, dtype=bool)
+        self.done = np.zeros(NO_OF_NODES, dtype=bool)
+        self.eno_sum = np.zeros(NO_OF_NODES)
+        self.recovery_steps = np.zeros(NO_OF_NODES, dtype=int)
+
+        # Observation variables
+        self.time_obs = self.time_stream[self.node_index, self.global_time]
+        self.henergy_obs = self.henergy_stream[self.node_index, self.global_time]
+        self.penergy_obs = self.penergy_stream[self.node_index, self.global_time]
+        self.benergy_obs = np.clip(self.batt,0,1)
+
+        # Sparse rewards: timeslots with a reward and a ring buffer of the last day of battery observations
+        if self.REWARD_TYPE == 'sparse':
+            TIMESLOTS_PER_DAY = len(self.env_timeslot_values)
+            self.reward_times = np.array([self.env_timeslot_values[-1] if quarter == 4
+                                          else self.env_timeslot_values[int(quarter*TIMESLOTS_PER_DAY/4)]
+                                          for quarter in self.REWARD_PARAM])
+            self.batt_hist = np.zeros((NO_OF_NODES, TIMESLOTS_PER_DAY))
+            self.hist_len = 0 # number of observations recorded so far
+            self.record_batt()
+        return self.get_obs()
+
+    def get_obs(self):
+        return np.stack((self.time_obs/self.READINGS_PER_DAY,
+                         self.henergy_obs,
+                         self.penergy_obs,
+                         self.benergy_obs), axis=1)
+
+    def record_batt(self):
+        self.batt_hist[:, self.hist_len % self.batt_hist.shape[1]] = self.benergy_obs
+        self.hist_len += 1
+
+    def step(self, action):
+        action = np.asarray(action)
+        active = ~self.done
+        benergy_obs = self.benergy_obs
+
+        # verify_action: a node goes into recovery if its battery is low or it cannot afford the action
+        RECOVERY_MODE = self.RECOVERY_MODE | (benergy_obs < self.MIN_BATT)
+        checked = active & ~RECOVERY_MODE
+        assert np.all((0 <= action[checked]) & (action[checked] < self.NO_OF_DUTY_CYCLES)), "Invalid Action"
+        sense_dc = action/self.NO_OF_DUTY_CYCLES + self.MIN_DC
+        harvested_energy = self.henergy_obs*self.HFACTOR
+        surplus_energy = harvested_energy - (sense_dc)*self.DFACTOR
+        RECOVERY_MODE |= ~((-surplus_energy) < benergy_obs)
+
+        # execute_action/recovery_action: battery.charge() or battery.discharge()
+        energy = np.where(RECOVERY_MODE, harvested_energy, surplus_energy)
+        batt = self.batt + np.where(RECOVERY_MODE | (energy > 0), energy*self.BEFF, energy)
+        batt = np.clip(batt,0,1)
+        self.batt = np.where(active, batt, self.batt)
+        self.RECOVERY_MODE = np.where(active, RECOVERY_MODE, self.RECOVERY_MODE)
+        self.eno_sum += np.where(active, energy, 0)
+        self.recovery_steps += active & RECOVERY_MODE
+
+        # reward (on the battery observation before the action)
+        reward = self.reward(benergy_obs)
+        reward[~active] = 0
+
+        # next_obs
+        self.global_time = self.global_time + active
+        self.time_obs = self.time_stream[self.node_index, self.global_time]
+        self.henergy_obs = self.henergy_stream[self.node_index, self.global_time]
+        self.penergy_obs = self.penergy_stream[self.node_index, self.global_time]
+        HARVESTER_END = active & (self.global_time == self.last_time)
+        updated = active & ~HARVESTER_END # the battery observation is not updated on the last timeslot
+        self.benergy_obs = np.where(updated, np.clip(self.batt,0,1), benergy_obs)
+        self.RECOVERY_MODE &= ~(updated & (self.benergy_obs > self.BINIT)) # snap out of recovery mode
+        self.done = self.done | HARVESTER_END
+        if self.REWARD_TYPE == 'sparse':
+            self.record_batt()
+
+        info = {}
+        return self.get_obs(), reward, self.done.copy(), info
+
+    def reward(self, benergy_obs):
+        if self.REWARD_TYPE == 'dense':
+            reward = ((0.5 - np.abs(benergy_obs - 0.5))*4 - 1)*self.REWARD_PARAM
+        else:
+            reward = np.zeros(self.NO_OF_NODES)
+            REWARD_TIME = np.isin(self.time_obs, self.reward_times)
+            if REWARD_TIME.any():
+                # mean of the battery observations of the last day, excluding the current one
+                TIMESLOTS_PER_DAY = self.batt_hist.shape[1]
+                window = min(self.hist_len, TIMESLOTS_PER_DAY) - 1
+                if window > 0:
+                    hist_index = (self.hist_len - 1 - window + np.arange(window)) % TIMESLOTS_PER_DAY
+                    mean_day_batt = np.mean(self.batt_hist[:, hist_index], axis=1)
+                else:
+                    mean_day_batt = np.full(self.NO_OF_NODES, np.nan)
+                lowthreshold = 2*self.MIN_BATT
+                day_reward = np.where((lowthreshold < mean_day_batt) & (mean_day_batt < (1-lowthreshold)), 1, -1)
+                reward = np.where(REWARD_TIME, day_reward, reward)
+        return np.where(self.RECOVERY_MODE, -1, reward)
+# End of VecEnoEnv
+########################################################
@@ -15,6 +15,13 @@ class add_enp_obs(gym.ObservationWrapper):
     def observation(self, obs):
         enp = 0.5 - obs[3] #BMAX/2 - benergy_obs
         return np.append(obs,enp)
+
+    @staticmethod
+    def obs_transform(OBS_SIZE): # observation(obs) == obs[index]*scale + offset
+        index = np.append(np.arange(OBS_SIZE), 3)
+        scale = np.append(np.ones(OBS_SIZE), -1.0)
+        offset = np.append(np.zeros(OBS_SIZE), 0.5)
+        return index, scale, offset
 ########################################################
 class remove_time_obs(gym.ObservationWrapper):
     def __init__(self, env=None):
@@ -26,6 +33,10 @@ class remove_time_obs(gym.ObservationWrapper):
 
     def observation(self, obs):
         return obs[1:]
+
+    @staticmethod
+    def obs_transform(OBS_SIZE): # observation(obs) == obs[index]*scale + offset
+        return np.arange(1, OBS_SIZE), np.ones(OBS_SIZE-1), np.zeros(OBS_SIZE-1)
 ########################################################
 class symmetric_normalize_obs(gym.ObservationWrapper):
     def __init__(self,env=None):
@@ -37,9 +48,100 @@ class symmetric_normalize_obs(gym.ObservationWrapper):
 
     def observation(self, obs):
         return (obs-0.5)*2
+
+    @staticmethod
+    def obs_transform(OBS_SIZE): # observation(obs) == obs[index]*scale + offset
+        # obs*2 - 1 rounds exactly like (obs-0.5)*2, since scaling by 2 is exact
+        return np.arange(OBS_SIZE), np.full(OBS_SIZE, 2.0), np.full(OBS_SIZE, -1.0)
 # [0, 1]       >>  -0.5 >>  [-0.5, 0.5]
 # [-0.5, 0.5]  >>  *2   >>  [-1,1]
 ########################################################
+
+########################################################
+# FUSED OBSERVATION WRAPPERS
+########################################################
+# A chain of the observation wrappers above is a gather followed by an affine map, so it
+# can be compiled into one obs[index]*scale + offset and applied in a single pass:
+#     env = wrappers.fused_obs(env, [wrappers.symmetric_normalize_obs, wrappers.add_enp_obs])
+# is equivalent to
+#     env = wrappers.add_enp_obs(wrappers.symmetric_normalize_obs(env))
+# (wrappers listed innermost first). The map is computed in float64 and rounded once to float32.
+def compose_obs_transforms(wrapper_classes, OBS_SIZE):
+    index = np.arange(OBS_SIZE)
+    scale = np.ones(OBS_SIZE)
+    offset = np.zeros(OBS_SIZE)
+    for wrapper_class in wrapper_classes:
+        wrapper_index, wrapper_scale, wrapper_offset = wrapper_class.obs_transform(len(index))
+        index = index[wrapper_index]
+        scale = scale[wrapper_index]*wrapper_scale
+        offset = offset[wrapper_index]*wrapper_scale + wrapper_offset
+    return index, scale, offset
+
+class obs_pipeline(object):
+    # Compiled chain of observation wrappers. Takes one observation or a batch (node x obs).
+    # REUSE_BUFFER=True writes every single observation into the same float32 array, so nothing is
+    # allocated per step; the returned array is overwritten by the next call, so copy it before
+    # keeping it (e.g. in a replay buffer).
+    def __init__(self, wrapper_classes, OBS_SIZE, REUSE_BUFFER=False):
+        self.index, self.scale, self.offset = compose_obs_transforms(wrapper_classes, OBS_SIZE)
+        # gather and scale as one matrix product: obs @ matrix == obs[index]*scale
+        # (the other products are exact zeros, so the result is rounded the same way)
+        self.matrix = np.zeros((OBS_SIZE, len(self.index)))
+        self.matrix[self.index, np.arange(len(self.index))] = self.scale
+        self.REUSE_BUFFER = REUSE_BUFFER
+        self.work = np.zeros(len(self.index))
+        self.out = np.zeros(len(self.index), dtype=np.float32)
+
+    def __call__(self, obs):
+        if type(obs) is not np.ndarray or obs.dtype != np.float64:
+            obs = np.asarray(obs, dtype=np.float64)
+        if obs.ndim > 1: # batch of observations
+            return (np.dot(obs, self.matrix) + self.offset).astype(np.float32)
+        np.dot(obs, self.matrix, out=self.work)
+        out = self.out if self.REUSE_BUFFER else np.empty(len(self.index), dtype=np.float32)
+        np.add(self.work, self.offset, out=out)
+        return out
+
+class fused_obs(gym.ObservationWrapper):
+    def __init__(self, env=None, wrapper_classes=(), REUSE_BUFFER=False):
+        super(fused_obs, self).__init__(env)
+        self.pipeline = obs_pipeline(wrapper_classes, self.env.observation_space.shape[0], REUSE_BUFFER)
+        self.observation_space = spaces.Box(low=-1.0, 
+                                            high=1.0, 
+                                            shape=(len(self.pipeline.index),),
+                                            dtype=np.float32)
+
+    def observation(self, obs):
+        return self.pipeline(obs)
+
+def fuse_obs_wrappers(env, REUSE_BUFFER=False):
+    # replaces the observation wrappers on top of env (e.g. wrap_all(env)) by one fused_obs
+    wrapper_classes = []
+    while isinstance(env, gym.ObservationWrapper) and hasattr(env, 'obs_transform'):
+        wrapper_classes.insert(0, type(env)) # the innermost wrapper is applied first
+        env = env.env
+    return fused_obs(env, wrapper_classes, REUSE_BUFFER)
+########################################################
+
+########################################################
+# MULTI-TIMESLOT STEPS THROUGH THE WRAPPERS
+########################################################
+# gym.Wrapper forwards unknown attributes to the env, so env.fast_forward_recovery() on a wrapped
+# env would return the raw observation. wrapped_step() calls the method on the base env and passes
+# the observation through the observation wrappers (innermost first):
+#     obs, reward, done, info = wrappers.wrapped_step(env, 'fast_forward_recovery', GAMMA=0.99)
+# Reward wrappers are not applied: they rate single timeslots.
+def wrapped_step(env, method, *args, **kwargs):
+    observation_wrappers = []
+    while isinstance(env, gym.Wrapper):
+        if isinstance(env, gym.ObservationWrapper):
+            observation_wrappers.insert(0, env)
+        env = env.env
+    obs, reward, done, info = getattr(env, method)(*args, **kwargs)
+    for wrapper in observation_wrappers:
+        obs = wrapper.observation(obs)
+    return obs, reward, done, info
+########################################################
     
 ########################################################
 # REWARD WRAPPERS
@@ -79,7 +181,7 @@ class sparse_reward(gym.RewardWrapper):
         if self.RECOVERY_MODE:
             return -1 # penalize recovery mode
         if self.time_obs == self.env_timeslot_values[-1]: # if end of day
-            batt_log = [obs[3] for obs in self.env_log]
+            batt_log = self.env_log[:,3]
             mean_day_batt = np.mean(batt_log[1-len(self.env_timeslot_values)])
             lowthreshold = 3*self.MIN_BATT
             if lowthreshold<mean_day_batt<(1-lowthreshold):
@@ -97,7 +199,7 @@ class sparse_reward_v2(gym.RewardWrapper):
         if self.RECOVERY_MODE:
             return -1 # penalize recovery mode
         if self.time_obs == self.env_timeslot_values[-1]: # if end of day
-            batt_log = [obs[3] for obs in self.env_log]
+            batt_log = self.env_log[:,3]
             mean_day_batt = np.mean(batt_log[1-len(self.env_timeslot_values)])
             lowthreshold = self.MIN_BATT
             if lowthreshold<mean_day_batt<(1-lowthreshold):
@@ -115,7 +217,7 @@ class sparse_reward_v2a(gym.RewardWrapper):
         if self.RECOVERY_MODE:
             return -1 # penalize recovery mode
         if self.time_obs == self.env_timeslot_values[-1]: # if end of day
-            batt_log = [obs[3] for obs in self.env_log]
+            batt_log = self.env_log[:,3]
             mean_day_batt = np.mean(batt_log[1-len(self.env_timeslot_values)])
             lowthreshold = self.MIN_BATT*2
             if lowthreshold<mean_day_batt<(1-lowthreshold):
@@ -133,7 +235,7 @@ class sparse_reward_v3(gym.RewardWrapper):
         if self.RECOVERY_MODE:
             return -1 # penalize recovery mode
         if self.time_obs == self.env_timeslot_values[-1]: # if end of day
-            batt_log = [obs[3] for obs in self.env_log]
+            batt_log = self.env_log[:,3]
             mean_day_batt = np.mean(batt_log[1-len(self.env_timeslot_values)])
             lowthreshold = self.MIN_BATT
             if lowthreshold<mean_day_batt<(1-lowthreshold):